@@ -57,12 +57,32 @@ def setupOptions():
     define("address", default="127.0.0.1", help="bind to the given address", metavar="ADDRESS")
     define("port", default=8081, help="run on the given port", type=int, metavar="PORT")
 
+    define("processes", default=1, help="number of worker processes to fork", type=int, metavar="NUM")
+
     define("plugins", default=[], help="plugins to load", type=list, metavar="PLUGINS")
 
     define("render_process_num", default=4, help="number of renderer processes to run", type=int, metavar="NUM")
 
+    define("dylib_max_age", default=60, help="let clients cache dylibs for specified seconds", type=int, metavar="SECONDS")
+
     define("cron_interval", default=360, help="run cron every specified seconds", type=int, metavar="INTERVAL")
 
+    define("events_batch_size", default=32, help="maximum number of packets returned by a single events poll", type=int, metavar="NUM")
+    define("events_linger", default=50, help="wait up to specified milliseconds for more packets before answering an events poll", type=int, metavar="MILLISECONDS")
+
+    define("session_queue_expiry", default=3600, help="seconds a session queue is kept on the broker without being consumed", type=int, metavar="SECONDS")
+    define("session_queue_length", default=1000, help="maximum number of messages held in a session queue on the broker", type=int, metavar="NUM")
+    define("session_buffer_size", default=256, help="maximum number of packets buffered per session on a node", type=int, metavar="NUM")
+    define("session_consumer_idle", default=120, help="stop consuming a session queue after specified seconds without a poll", type=int, metavar="SECONDS")
+    define("session_consumer_stranded", default=5, help="requeue packets buffered for a session after specified seconds without a poll on this node", type=int, metavar="SECONDS")
+
+    define("session_cache_ttl", default=30, help="cache session tokens for specified seconds", type=int, metavar="SECONDS")
+    define("session_cache_size", default=10000, help="maximum number of session tokens cached per node", type=int, metavar="NUM")
+    define("permission_cache_ttl", default=300, help="recompile group permissions after specified seconds, in case a change notification was missed", type=int, metavar="SECONDS")
+
+    define("presence_flush_interval", default=30, help="write session activity to the database every specified seconds", type=int, metavar="SECONDS")
+    define("presence_flush_batch", default=500, help="maximum number of sessions per activity update statement", type=int, metavar="NUM")
+
     define("session_expiry", default=3600, help="expire inactive sessions after specified seconds", type=int, metavar="EXPIRY")
 
     define("sql_store", default="postgresql", help="sql server store", metavar="HOST")
@@ -78,6 +98,22 @@ def setupOptions():
     define("amqp_password", default="guest", help="amqp server password (put in apollod.conf)", metavar="PASSWORD")
     define("amqp_vhost", default="/", help="amqp vhost", metavar="VHOST")
 
+    define("bus_backend", default="amqp", help="message bus backend (amqp, or loopback for a single process without a broker)", metavar="BACKEND")
+
+    define("amqp_management_url", default="", help="broker management API url, for sweeping orphaned queues (e.g. http://localhost:15672)", metavar="URL")
+
+    define("amqp_confirms", default=False, help="use publisher confirms", type=bool, metavar="CONFIRMS")
+    define("bus_outbox_size", default=10000, help="maximum number of messages waiting to be published", type=int, metavar="NUM")
+
+    define("bus_reconnect_min", default=1, help="seconds to wait before first reconnecting to the message bus", type=int, metavar="SECONDS")
+    define("bus_reconnect_max", default=30, help="maximum seconds to wait between reconnects to the message bus", type=int, metavar="SECONDS")
+    define("bus_topology_window", default=32, help="maximum number of queue declares, binds and deletes waiting on the broker at once", type=int, metavar="NUM")
+
+    define("inter_partitions", default=16, help="number of inter queues to partition traffic over (must be the same on every node)", type=int, metavar="NUM")
+    define("partition_heartbeat", default=5, help="seconds between node heartbeats for partition ownership", type=int, metavar="SECONDS")
+    define("inter_prefetch", default=100, help="maximum number of unacknowledged inter messages per node", type=int, metavar="NUM")
+    define("inter_ack_batch", default=20, help="number of inter messages to acknowledge at once", type=int, metavar="NUM")
+
     define("logging_level", default=logging.WARN, help="logging level", type=int, metavar="LEVEL")
 
 def setupDBSession():
@@ -27,6 +27,7 @@ The heart of the Apollo server.
 import logging
 import os
 
+from tornado.ioloop import IOLoop
 from tornado.options import options
 from tornado.template import Loader
 from tornado.web import Application
@@ -35,16 +36,31 @@ from apollo.server import setupDBSession
 from apollo.server.plugins import PluginRegistry
 
 from apollo.server.render.supervisor import RendererSupervisor
-from apollo.server.web import FrontendHandler, SessionHandler, ActionHandler, EventsHandler, DylibHandler
+from apollo.server.render.remote import RenderServer, RemoteRendererSupervisor
+from apollo.server.web import FrontendHandler, BundleHandler, SessionHandler, ActionHandler, EventsHandler, SocketHandler, DylibHandler
 from apollo.server.cron import CronScheduler
+from apollo.server.sessioncache import SessionCache
+from apollo.server.permissions import PermissionCache
+from apollo.server.presence import PresenceTracker
+from apollo.server.realmgrid import RealmGridRegistry
 from apollo.server.dylib.meta import DylibDispatcher
+from apollo.server.frontend import FrontendBundle
 from apollo.server.messaging.bus import Bus
+from apollo.server.messaging.consumer import SessionConsumerRegistry
+from apollo.server.messaging.index import RoutingIndex
+from apollo.server.messaging.partition import PartitionManager
 
 class Core(Application):
     """
     The very core of Apollo. Everything depends on this.
+
+    When running several worker processes, only one of them owns the renderer
+    pool; the others forward their render requests to it.
     """
-    def __init__(self):
+    def __init__(self, render_owner=True):
+        self.render_owner = render_owner
+        self.stopping = False
+
         logging.getLogger().setLevel(options.logging_level)
 
         if options.debug:
@@ -60,11 +76,13 @@ class Core(Application):
         Application.__init__(
             self,
             [
-                (r"/",                  FrontendHandler),
-                (r"/session",           SessionHandler),
-                (r"/action",            ActionHandler),
-                (r"/events",            EventsHandler),
-                (r"/dylib/(.*)\.js",    DylibHandler)
+                (r"/",                         FrontendHandler),
+                (r"/bundle/([0-9a-f]+)\.js",   BundleHandler),
+                (r"/session",                  SessionHandler),
+                (r"/action",                   ActionHandler),
+                (r"/events",                   EventsHandler),
+                (r"/ws",                       SocketHandler),
+                (r"/dylib/(.*)\.js",           DylibHandler)
             ],
             dist_root   = dist_root,
             static_path = os.path.join(dist_root, "static"),
@@ -76,7 +94,15 @@ class Core(Application):
         setupDBSession()
 
         self.dylib_dispatcher = DylibDispatcher(self)
+        self.frontend = FrontendBundle(self)
         self.bus = Bus(self)
+        self.routing = RoutingIndex(self)
+        self.partitions = PartitionManager(self)
+        self.consumers = SessionConsumerRegistry(self)
+        self.session_cache = SessionCache(self)
+        self.permissions = PermissionCache(self)
+        self.presence = PresenceTracker(self)
+        self.grids = RealmGridRegistry(self)
         self.plugins = PluginRegistry(self)
         self.cron = CronScheduler(self)
 
@@ -85,10 +111,42 @@ class Core(Application):
         Start the server proper.
         """
         self.bus.go()
+        self.routing.go()
+        self.partitions.go()
+        self.consumers.go()
+        self.presence.go()
+        self.session_cache.go()
+        self.grids.go()
+        self.permissions.go()
         self.plugins.loadPluginsFromOptions()
         self.cron.go()
 
         logging.info("Server ready (may be still waiting for message bus).")
 
-        self.rendervisor = RendererSupervisor()
+        if self.render_owner:
+            self.rendervisor = RendererSupervisor(self.grids)
+            if options.processes > 1:
+                self.bus.onReady(RenderServer(self, self.rendervisor).go)
+        else:
+            self.rendervisor = RemoteRendererSupervisor(self)
         self.rendervisor.go()
+
+    def stop(self, server):
+        """
+        Shut the server down cleanly and stop the IOLoop.
+
+        :Parameters:
+             * ``server``
+               The HTTP server serving the core.
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+
+        logging.info("Shutting down server...")
+
+        server.stop()
+        self.presence.flush()
+        self.rendervisor.stop()
+        self.partitions.stop()
+        self.bus.stop(IOLoop.instance().stop)
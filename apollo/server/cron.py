@@ -20,6 +20,7 @@
 # THE SOFTWARE.
 #
 
+import uuid
 import logging
 
 from datetime import datetime, timedelta
@@ -34,6 +35,13 @@ from apollo.server.models import meta
 from apollo.server.models.auth import Session, User
 from apollo.server.protocol.packet.packetlogout import PacketLogout
 
+from apollo.server.messaging.pipeline import BindPipeline
+
+from apollo.server.util.cache import registry as caches
+
+# number of session ids to look up per query when sweeping queues
+SWEEP_BATCH = 500
+
 class CronScheduler(Component):
     """
     Apollo scheduler service. Performs clean up of dead sessions, etc.
@@ -44,16 +52,30 @@ class CronScheduler(Component):
         """
         sess = meta.Session()
 
+        # anything sent while the bus is down is held until it reconnects
         if not self.core.bus.ready:
-            logging.warn("Bus is not ready, not running cron.")
-            return
+            logging.warn("Bus is not ready, running cron anyway.")
 
         logging.info("Running cron...")
 
-        cursor = sess.query(Session).filter(Session.last_active <= datetime.utcnow() - timedelta(seconds=options.session_expiry))
-        num_rows = cursor.count()
+        cutoff = datetime.utcnow() - timedelta(seconds=options.session_expiry)
+        expired_ids = []
+
+        pipeline = BindPipeline(self.core.bus, "expire")
+
+        for session in sess.query(Session).filter(Session.last_active <= cutoff):
+            # this node may have seen activity it hasn't written out yet
+            last_active = self.core.presence.lastActive(session.id)
+            if last_active is not None and last_active > cutoff:
+                continue
+
+            expired_ids.append(session.id)
+
+            self.core.presence.forget(session.id)
+            self.core.consumers.release(session.id)
+            self.core.session_cache.invalidate(session.id)
+            pipeline.delete("ex:%s" % session.id)
 
-        for session in cursor:
             if session.user_id is None:
                 continue
             user = sess.query(User).get(session.user_id)
@@ -63,9 +85,64 @@ class CronScheduler(Component):
                 user.online = False
                 sess.merge(user)
 
-        cursor.delete()
+        if expired_ids:
+            sess.query(Session).filter(Session.id.in_(expired_ids)).delete(synchronize_session=False)
         sess.commit()
-        logging.info("Purged %d expired session(s)." % num_rows)
+        logging.info("Purged %d expired session(s)." % len(expired_ids))
+
+        pipeline.run()
+        self.core.bus.listQueues(self.sweepQueues)
+
+        for name, cache in caches.items():
+            cache.purge()
+            logging.info(("Cache %s: " % name) + "%(hits)d hit(s), %(misses)d miss(es), %(evictions)d evicted, %(expirations)d expired, %(size)d cached." % cache.stats())
+        logging.info("Bus: %(published)d published in %(batches)d batch(es) (mean %(mean_batch).1f, max %(max_batch)d), %(mean_latency).1f ms mean latency, %(dropped)d dropped, %(nacked)d rejected, %(replayed)d replayed, %(unconfirmed)d unconfirmed." % self.core.bus.publishStats())
+        logging.info("Inter: %(processed)d processed in %(acks)d ack(s) (mean %(mean_ack).1f), %(in_flight)d in flight (max %(max_in_flight)d)." % self.core.bus.interStats())
+        logging.info("Partitions: consuming %(owned)d of %(partitions)d across %(nodes)d node(s)." % self.core.partitions.stats())
+        logging.info("Channels: %(open)d open, %(queued)d topology operation(s) queued, %(inflight)d waiting on the broker." % self.core.bus.pool.stats())
+
+        for name, stats in self.core.bus.pipelineStats().iteritems():
+            logging.info("Pipeline %s: %d run(s), %.1f ms mean, %.1f ms max." % (name, stats["runs"], stats["mean"], stats["max"]))
+
+    def sweepQueues(self, queues):
+        """
+        Delete the session queues left on the broker by sessions that no
+        longer exist.
+
+        :Parameters:
+             * ``queues``
+               Names of the queues on the broker, or ``None`` if they can't
+               be listed.
+        """
+        if queues is None:
+            return
+
+        queue_ids = {}
+
+        for queue in queues:
+            if not queue.startswith("ex:"):
+                continue
+
+            try:
+                queue_ids[uuid.UUID(hex=queue[len("ex:"):])] = queue
+            except ValueError:
+                continue
+
+        sess = meta.Session()
+
+        ids = queue_ids.keys()
+        for i in xrange(0, len(ids), SWEEP_BATCH):
+            batch = ids[i:i + SWEEP_BATCH]
+
+            for session_id, in sess.query(Session.id).filter(Session.id.in_(batch)):
+                del queue_ids[session_id]
+
+        pipeline = BindPipeline(self.core.bus, "sweep")
+        for queue in queue_ids.itervalues():
+            pipeline.delete(queue)
+        pipeline.run()
+
+        logging.info("Swept %d orphaned session queue(s)." % len(queue_ids))
 
     def go(self):
         """
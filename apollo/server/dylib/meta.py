@@ -26,8 +26,31 @@ Dylib dispatching and autodiscovery.
 
 from apollo.server.component import Component
 from apollo.server.util.importlib import import_module
+from apollo.server.util.compression import gzipString
 
 import os
+import hashlib
+
+class CompiledDylib(object):
+    """
+    The generated output of a dylib, ready to be served.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        """
+        Generated JavaScript.
+        """
+
+        self.etag = hashlib.sha1(data).hexdigest()
+        """
+        Content hash of the generated JavaScript.
+        """
+
+        self.gzipped = gzipString(data)
+        """
+        Gzipped generated JavaScript.
+        """
 
 class DylibDispatcher(Component):
     """
@@ -37,8 +60,10 @@ class DylibDispatcher(Component):
     def __init__(self, core):
         super(DylibDispatcher, self).__init__(core)
         self.dylibs = {}
+        self.compiled = {}
 
         self.autodiscover()
+        self.compile()
 
     def autodiscover(self):
         """
@@ -63,6 +88,20 @@ class DylibDispatcher(Component):
                         member = getattr(module, member_name)
                         self.dylibs[member.name] = member(self.core)
 
+    def compile(self):
+        """
+        Generate the output of all dylibs. This needs to be called again
+        whenever something a dylib generates from changes (e.g. plugins being
+        loaded or unloaded).
+        """
+        compiled = {}
+        for name, dylib in self.dylibs.iteritems():
+            data = dylib.generate()
+            if isinstance(data, unicode):
+                data = data.encode("utf-8")
+            compiled[name] = CompiledDylib(data)
+        self.compiled = compiled
+
     def dispatch(self, pathspec):
         """
         Dispatch a dylib request according to a path specification.
@@ -70,7 +109,8 @@ class DylibDispatcher(Component):
         :Parameters:
             * ``pathspec``
               Path specification.
+
+        :Returns:
+            A ``CompiledDylib``, or ``None`` if there is no such dylib.
         """
-        if pathspec in self.dylibs:
-            return self.dylibs[pathspec].generate()
-        return None
+        return self.compiled.get(pathspec)
@@ -0,0 +1,157 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Builder for the Apollo client frontend bundle.
+"""
+
+import os
+import re
+import hashlib
+
+from apollo.server.component import Component
+from apollo.server.util.compression import gzipString
+
+REQUIRE_EXPR = re.compile(r"""dojo\.require\(["'](apollo\.client\.[\w.]+)["']\)""")
+"""
+Expression matching ``dojo.require`` calls for Apollo client modules.
+"""
+
+DYLIB_PREFIX = "apollo.client.dylib."
+"""
+Module prefix of dylibs.
+"""
+
+def minify(source):
+    """
+    Conservatively minify JavaScript source. Strips comments that begin a line
+    and all leading and trailing whitespace, but keeps line breaks so
+    semicolon insertion still works.
+
+    :Parameters:
+         * ``source``
+           JavaScript source.
+    """
+    output = []
+    in_comment = False
+
+    for line in source.splitlines():
+        line = line.strip()
+
+        if in_comment:
+            if "*/" not in line:
+                continue
+            in_comment = False
+            line = line[line.index("*/") + 2:].strip()
+
+        if line.startswith("/*"):
+            if "*/" not in line:
+                in_comment = True
+                continue
+            line = line[line.index("*/") + 2:].strip()
+
+        if line and not line.startswith("//"):
+            output.append(line)
+
+    return "\n".join(output) + "\n"
+
+def buildBundle(dist_root, dylibs):
+    """
+    Concatenate the Apollo client modules required by ``bootstrap.js`` (and
+    everything they require), in dependency order, followed by
+    ``bootstrap.js`` itself. Dojo then finds every Apollo module already
+    provided and doesn't request any of them individually.
+
+    :Parameters:
+         * ``dist_root``
+           Apollo distribution root.
+
+         * ``dylibs``
+           Dictionary of dylib names to their generated output.
+
+    :Returns:
+        The minified bundle source.
+    """
+    lib_path = os.path.join(dist_root, "static", "lib")
+
+    def loadModule(name):
+        if name.startswith(DYLIB_PREFIX):
+            return dylibs[name[len(DYLIB_PREFIX):]]
+        with open(os.path.join(lib_path, *name.split(".")) + ".js") as f:
+            return f.read()
+
+    sources = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+
+        source = loadModule(name)
+        for depend in REQUIRE_EXPR.findall(source):
+            visit(depend)
+        sources.append(source)
+
+    with open(os.path.join(lib_path, "bootstrap.js")) as f:
+        bootstrap = f.read()
+
+    for name in REQUIRE_EXPR.findall(bootstrap):
+        visit(name)
+    sources.append(bootstrap)
+
+    return "".join(minify(source) for source in sources)
+
+def renderFrontend(loader, bootstrap):
+    """
+    Render the frontend page.
+
+    :Parameters:
+         * ``loader``
+           Template loader.
+
+         * ``bootstrap``
+           URL of the script that bootstraps the client.
+    """
+    return loader.load("frontend.html").generate(bootstrap=bootstrap)
+
+class FrontendBundle(Component):
+    """
+    The client frontend page and bundle, built in memory.
+    """
+
+    def __init__(self, core):
+        super(FrontendBundle, self).__init__(core)
+        self.build()
+
+    def build(self):
+        """
+        Build the bundle from the current dylib output. This needs to be called
+        again whenever the dylibs are recompiled.
+        """
+        dylibs = dict((name, dylib.data) for name, dylib in self.core.dylib_dispatcher.compiled.iteritems())
+
+        self.bundle = buildBundle(self.core.settings["dist_root"], dylibs)
+        self.bundle_hash = hashlib.sha1(self.bundle).hexdigest()
+        self.bundle_gzipped = gzipString(self.bundle)
+
+        self.frontend = renderFrontend(self.core.loader, "bundle/%s.js" % self.bundle_hash)
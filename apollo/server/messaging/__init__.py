@@ -27,13 +27,13 @@ Apollo's cross-server communication and packet routing system.
 from apollo.server.models import meta
 from apollo.server.models.auth import User
 
-from apollo.server.util.cache import memoize
+from apollo.server.util.cache import cachedmethod
 
 class FakeSession(object):
     def __init__(self, user_id):
         self.user_id = user_id
 
-    @memoize
+    @cachedmethod(max_size=1)
     def _get_user(self):
         sess = meta.Session()
         return sess.query(User).get(self.user_id)
@@ -20,24 +20,89 @@
 # THE SOFTWARE.
 #
 
+import json
+import time
 import uuid
+import random
+import urllib
 import logging
 
+from collections import deque
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
 from tornado.options import options
 
-from pika.adapters import TornadoConnection
-from pika import PlainCredentials, ConnectionParameters, BasicProperties
+from pika.adapters import TornadoConnection, BlockingConnection
+from pika import PlainCredentials, ConnectionParameters, BasicProperties, spec
 
 from apollo.server.component import Component
-from apollo.server.models.geography import Realm, Tile, Chunk
 
-from apollo.server.protocol.packet import ORIGIN_INTER
+from apollo.server.protocol.packet import ORIGIN_INTER, DELIVERY_PERSISTENT
 from apollo.server.protocol.packet.meta import deserializePacket
 
+from apollo.server.models import meta
+
 from apollo.server.messaging import FakeSession
+from apollo.server.messaging.loopback import LoopbackConnection
+from apollo.server.messaging.partition import partitionKey
+from apollo.server.messaging.channels import ChannelPool, CHANNEL_PUBLISH, CHANNEL_INTER
 
-from apollo.server.models import meta
-from apollo.server.models.auth import User
+def connectionParameters():
+    """
+    Get the parameters for connecting to the AMQP broker, from the options.
+    """
+    return ConnectionParameters(
+        credentials=PlainCredentials(
+            options.amqp_username,
+            options.amqp_password
+        ),
+        host=options.amqp_host,
+        port=options.amqp_port,
+        virtual_host=options.amqp_vhost
+    )
+
+def publishBlocking(routing_key, body=""):
+    """
+    Publish one message from outside the server (e.g. from a tool), over a
+    short-lived blocking connection. Returns ``False`` if the broker couldn't
+    be reached.
+
+    :Parameters:
+         * ``routing_key``
+           Routing key to publish to.
+
+         * ``body``
+           Message body.
+    """
+    try:
+        connection = BlockingConnection(connectionParameters())
+        connection.channel().basic_publish(exchange="amq.topic", routing_key=routing_key, body=body)
+        connection.close()
+    except Exception, e:
+        logging.warn("Could not publish to %s: %s: %s" % (routing_key, e.__class__.__name__, e))
+        return False
+    return True
+
+def connectAMQP(bus):
+    """
+    Connect to the AMQP broker.
+    """
+    return TornadoConnection(
+        parameters=bus.parameters,
+        on_open_callback=bus.on_amqp_connection_open
+    )
+
+def connectLoopback(bus):
+    """
+    Connect to the in-process loopback broker.
+    """
+    return LoopbackConnection(on_open_callback=bus.on_amqp_connection_open)
+
+backends = {
+    "amqp"      : connectAMQP,
+    "loopback"  : connectLoopback
+}
 
 class Bus(Component):
     """
@@ -47,48 +112,170 @@ class Bus(Component):
         super(Bus, self).__init__(core)
 
         self.ready = False
+        self.ready_callbacks = []
+        self.reconnect_callbacks = []
+
+        self.connected = False
+        self.stopping = False
+        self.reconnect_attempts = 0
+        self.was_ready = False
 
         self.busName = uuid.uuid4().hex
 
-        self.parameters = ConnectionParameters(
-            credentials=PlainCredentials(
-                options.amqp_username,
-                options.amqp_password
-            ),
-            host=options.amqp_host,
-            port=options.amqp_port,
-            virtual_host=options.amqp_vhost
-        )
+        self.pool = ChannelPool(self)
+
+        self.outbox = deque()
+        self.flush_scheduled = False
+
+        self.unconfirmed = {}
+        self.publish_seq = 0
+
+        self.inter_unacked = 0
+        self.inter_last_tag = None
+        self.ack_scheduled = False
+
+        self.inter_stats = {
+            "processed"     : 0,
+            "acks"          : 0,
+            "max_in_flight" : 0
+        }
+
+        self.pipeline_stats = {}
+
+        self.publish_stats = {
+            "published"     : 0,
+            "dropped"       : 0,
+            "nacked"        : 0,
+            "replayed"      : 0,
+            "batches"       : 0,
+            "max_batch"     : 0,
+            "latency"       : 0.0,
+            "latency_num"   : 0
+        }
+
+        self.parameters = connectionParameters()
 
     def go(self):
-        self.amqp = TornadoConnection(
-            parameters=self.parameters,
-            on_open_callback=self.on_amqp_connection_open
-        )
+        if options.bus_backend not in backends:
+            raise ValueError("Unknown bus backend: %s" % options.bus_backend)
+
+        self.connect()
+
+    def connect(self):
+        """
+        Connect to the message bus. If the connection fails or is lost later,
+        the bus keeps trying to reconnect.
+        """
+        if self.stopping:
+            return
+
+        try:
+            self.amqp = backends[options.bus_backend](self)
+        except Exception:
+            logging.exception("Could not connect to the message bus.")
+            self.scheduleReconnect()
+            return
+
+        self.amqp.add_on_close_callback(self.on_amqp_connection_closed)
+
+    def scheduleReconnect(self):
+        """
+        Try to connect again after an exponential backoff, between
+        ``bus_reconnect_min`` and ``bus_reconnect_max`` seconds. The delay is
+        jittered, so nodes that lost the broker together don't all come back
+        at once.
+        """
+        delay = min(options.bus_reconnect_max, options.bus_reconnect_min * 2 ** self.reconnect_attempts)
+        delay *= random.uniform(0.5, 1.0)
+
+        self.reconnect_attempts += 1
+
+        logging.warn("Reconnecting to the message bus in %.1f seconds (attempt %d)." % (delay, self.reconnect_attempts))
+        IOLoop.instance().add_timeout(time.time() + delay, self.connect)
+
+    def stop(self, callback=None):
+        """
+        Close the connection to the message bus.
+
+        :Parameters:
+             * ``callback``
+               Function to call once the connection is closed.
+        """
+        callback = callback or (lambda: None)
+
+        self.ready = False
+        self.stopping = True
+
+        self.flush()
+        self.flushAcks()
+
+        self.pool.close()
+
+        if not self.connected:
+            if self.outbox:
+                logging.warn("Message bus is down, dropping %d unpublished message(s)." % len(self.outbox))
+            callback()
+            return
+
+        self.amqp.add_on_close_callback(lambda *args: callback())
+        self.amqp.close()
+
+    def onReady(self, callback):
+        """
+        Call a function once the bus is ready, or right away if it already is.
+
+        :Parameters:
+             * ``callback``
+               Function to call.
+        """
+        if self.ready:
+            callback()
+        else:
+            self.ready_callbacks.append(callback)
+
+    def onReconnect(self, callback):
+        """
+        Call a function every time the bus is ready again after losing its
+        connection, e.g. to catch up on anything missed in the meantime.
+
+        :Parameters:
+             * ``callback``
+               Function to call.
+        """
+        self.reconnect_callbacks.append(callback)
 
     def on_amqp_connection_open(self, conn):
-        self.amqp.channel(self.on_amqp_channel_open)
+        self.connected = True
+        self.reconnect_attempts = 0
 
-    def on_amqp_channel_open(self, channel):
-        self.channel = channel
+        self.pool.open(self.amqp)
 
-        self.declareQueue("inter", self.on_queue_declared)
+    def on_amqp_connection_closed(self, *args):
+        if self.stopping:
+            return
 
-    def on_queue_declared(self, something):
-        self.channel.basic_consume(
-            consumer_callback=self.on_inter_message,
-            queue="inter",
-            no_ack=False
-        )
+        if self.connected:
+            logging.warn("Lost connection to the message bus; holding %d message(s) until it is back." % len(self.outbox))
 
-        self.channel.queue_bind(
-            exchange="amq.topic",
-            queue="inter",
-            routing_key="inter.#"
-        )
+            self.connected = False
+            self.ready = False
+            self.pool.lost()
+
+        self.scheduleReconnect()
+
+    def on_pool_ready(self):
         self.ready = True
         logging.info("Message bus ready.")
 
+        callbacks, self.ready_callbacks = self.ready_callbacks, []
+        for callback in callbacks:
+            callback()
+
+        if self.was_ready:
+            for callback in self.reconnect_callbacks:
+                callback()
+        self.was_ready = True
+
     def send(self, dest, packet):
         """
         Send a packet to a specific destination.
@@ -101,78 +288,417 @@ class Bus(Component):
              * ``packet``
                Packet to send.
         """
-        packet_dump = packet.dump()
+        packet_dump = packet.freeze()
         logging.debug("Sending to %s: %s" % (dest, packet_dump))
-        self.channel.basic_publish(
-            exchange="amq.topic",
-            routing_key=dest,
-            body=packet_dump,
-            properties=BasicProperties(
-                delivery_mode=2
-           )
+        self.publish(dest, packet_dump, packet.delivery, packet.name)
+
+    def publish(self, dest, body, delivery=DELIVERY_PERSISTENT, packet_type=None):
+        """
+        Queue a raw message body for publishing to a specific destination.
+        The outbox is published in one batch per IOLoop iteration.
+
+        Returns ``False`` if the outbox is full and the message was dropped.
+
+        :Parameters:
+             * ``dest``
+               Destination routing key. Inter routing keys are rewritten to
+               go through their partition.
+
+             * ``body``
+               Message body.
+
+             * ``delivery``
+               Delivery class of the message. Only ``DELIVERY_PERSISTENT``
+               messages are written to disk by the broker.
+
+             * ``packet_type``
+               Name of the packet type in the body, if any.
+        """
+        if dest.startswith("inter."):
+            dest = partitionKey(dest)
+
+        if len(self.outbox) >= options.bus_outbox_size:
+            logging.warn("Outbox is full, dropping message to %s: %s" % (dest, body))
+            self.publish_stats["dropped"] += 1
+            return False
+
+        self.outbox.append((dest, body, BasicProperties(
+            delivery_mode=delivery == DELIVERY_PERSISTENT and 2 or 1,
+            type=packet_type
+        ), time.time()))
+
+        self.scheduleFlush()
+        return True
+
+    def congested(self):
+        """
+        Check if the outbox is filling up faster than it can be published.
+        Callers that can shed load should do so while this is true.
+        """
+        return len(self.outbox) + len(self.unconfirmed) >= options.bus_outbox_size // 2
+
+    def scheduleFlush(self):
+        """
+        Flush the outbox on the next IOLoop iteration.
+        """
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            IOLoop.instance().add_callback(self.flush)
+
+    def flush(self):
+        """
+        Publish everything in the outbox.
+        """
+        self.flush_scheduled = False
+
+        channel = self.pool.get(CHANNEL_PUBLISH)
+
+        if channel is None or not self.outbox:
+            return
+
+        batch_size = len(self.outbox)
+
+        while self.outbox:
+            dest, body, properties, queued = self.outbox.popleft()
+
+            channel.basic_publish(
+                exchange="amq.topic",
+                routing_key=dest,
+                body=body,
+                properties=properties
+            )
+
+            if options.amqp_confirms:
+                self.publish_seq += 1
+                self.unconfirmed[self.publish_seq] = (dest, body, properties, queued)
+            else:
+                self.recordLatency(queued)
+
+        self.publish_stats["published"] += batch_size
+        self.publish_stats["batches"] += 1
+        self.publish_stats["max_batch"] = max(self.publish_stats["max_batch"], batch_size)
+
+    def on_publish_channel_lost(self):
+        """
+        Put anything published on a channel that has gone away without being
+        confirmed back at the front of the outbox, to be published again on
+        the new channel. Without confirms, anything already written to the old
+        channel is lost.
+        """
+        if self.unconfirmed:
+            logging.warn("Replaying %d unconfirmed message(s)." % len(self.unconfirmed))
+            self.publish_stats["replayed"] += len(self.unconfirmed)
+
+            self.outbox.extendleft(self.unconfirmed[seq] for seq in sorted(self.unconfirmed, reverse=True))
+
+        self.unconfirmed = {}
+        self.publish_seq = 0
+
+    def recordLatency(self, queued):
+        self.publish_stats["latency"] += time.time() - queued
+        self.publish_stats["latency_num"] += 1
+
+    def on_delivery_confirmation(self, frame):
+        """
+        Handle a publisher confirm (or rejection) from the broker.
+        """
+        method = frame.method
+
+        if method.multiple:
+            seqs = [ seq for seq in self.unconfirmed if seq <= method.delivery_tag ]
+        else:
+            seqs = [ method.delivery_tag ]
+
+        for seq in seqs:
+            entry = self.unconfirmed.pop(seq, None)
+            if entry is None:
+                continue
+
+            if isinstance(method, spec.Basic.Nack):
+                self.publish_stats["nacked"] += 1
+            else:
+                self.recordLatency(entry[3])
+
+        if isinstance(method, spec.Basic.Nack):
+            logging.warn("Broker rejected %d message(s)." % len(seqs))
+
+    def publishStats(self):
+        """
+        Get publishing counters: messages published, dropped, rejected and
+        replayed after losing the publish channel, the number of batches, mean
+        and largest batch size, and mean latency (from being queued to being
+        confirmed, or to being written if confirms are off) in milliseconds.
+        """
+        stats = self.publish_stats
+
+        return {
+            "published"     : stats["published"],
+            "dropped"       : stats["dropped"],
+            "nacked"        : stats["nacked"],
+            "replayed"      : stats["replayed"],
+            "batches"       : stats["batches"],
+            "mean_batch"    : stats["batches"] and float(stats["published"]) / stats["batches"] or 0.0,
+            "max_batch"     : stats["max_batch"],
+            "mean_latency"  : stats["latency_num"] and stats["latency"] * 1000.0 / stats["latency_num"] or 0.0,
+            "unconfirmed"   : len(self.unconfirmed),
+            "queued"        : len(self.outbox)
+        }
+
+    def recordPipeline(self, name, elapsed):
+        """
+        Record how long a bind pipeline took to be confirmed.
+
+        :Parameters:
+             * ``name``
+               Name of the pipeline.
+
+             * ``elapsed``
+               Seconds from sending the pipeline to the last confirmation.
+        """
+        runs, total, longest = self.pipeline_stats.get(name, (0, 0.0, 0.0))
+        self.pipeline_stats[name] = (runs + 1, total + elapsed, max(longest, elapsed))
+
+    def pipelineStats(self):
+        """
+        Get bind pipeline timings by pipeline name: number of runs, and mean
+        and longest time to confirmation in milliseconds.
+        """
+        return dict(
+            (name, {
+                "runs"          : runs,
+                "mean"          : total * 1000.0 / runs,
+                "max"           : longest * 1000.0
+            })
+            for name, (runs, total, longest) in self.pipeline_stats.iteritems()
         )
 
-    def declareQueue(self, queue, callback=None):
-        self.channel.queue_declare(
+    def declareQueue(self, queue, callback=None, exclusive=False, durable=False, arguments=None):
+        """
+        Declare a queue.
+
+        :Parameters:
+             * ``queue``
+               Name of the queue.
+
+             * ``callback``
+               Function to call once the queue is declared.
+
+             * ``exclusive``
+               Declare the queue for this connection only. It is deleted when
+               the connection closes.
+
+             * ``durable``
+               Declare the queue so it survives a broker restart, along with
+               any persistent messages in it.
+
+             * ``arguments``
+               Extra queue arguments (``x-*``) for the broker.
+        """
+        self.pool.topology("queue_declare", dict(
             queue=queue,
-            auto_delete=False,
-            callback=callback
+            durable=durable,
+            auto_delete=exclusive,
+            exclusive=exclusive,
+            arguments=arguments
+        ), callback)
+
+    def consume(self, queue, callback, no_ack=False, consumer_tag=None, traffic=CHANNEL_INTER):
+        """
+        Start consuming a queue.
+
+        :Parameters:
+             * ``queue``
+               Name of the queue.
+
+             * ``callback``
+               Function to call with each message, as
+               ``callback(channel, method, header, body)``.
+
+             * ``no_ack``
+               Don't require messages to be acknowledged.
+
+             * ``consumer_tag``
+               Tag to identify the consumer by, for cancelling it later.
+
+             * ``traffic``
+               Class of traffic, which decides the channel the consumer is on.
+        """
+        return self.pool.consume(traffic, queue, callback, no_ack, consumer_tag)
+
+    def cancel(self, consumer_tag):
+        """
+        Stop a consumer.
+
+        :Parameters:
+             * ``consumer_tag``
+               Tag of the consumer.
+        """
+        self.pool.cancel(consumer_tag)
+
+    def listQueues(self, callback):
+        """
+        List the names of every queue on the broker. AMQP itself can't do
+        this, so with the ``amqp`` backend it goes through the broker's
+        management API at ``amqp_management_url``, if set.
+
+        :Parameters:
+             * ``callback``
+               Function to call with the list of names, or ``None`` if the
+               queues can't be listed.
+        """
+        if options.bus_backend == "loopback":
+            callback(self.amqp.broker.queues.keys())
+            return
+
+        if not options.amqp_management_url:
+            callback(None)
+            return
+
+        def _listed(response):
+            if response.error:
+                logging.warn("Could not list queues: %s" % response.error)
+                callback(None)
+                return
+
+            callback([ queue["name"] for queue in json.loads(response.body) ])
+
+        AsyncHTTPClient().fetch(
+            "%s/api/queues/%s?columns=name" % (options.amqp_management_url.rstrip("/"), urllib.quote(options.amqp_vhost, safe="")),
+            _listed,
+            auth_username=options.amqp_username,
+            auth_password=options.amqp_password
         )
 
     def bindQueue(self, queue, dest, callback=None):
         logging.debug("Binding %s to %s" % (queue, dest))
-        self.channel.queue_bind(
+        self.pool.topology("queue_bind", dict(
             exchange="amq.topic",
             queue=queue,
-            routing_key=dest,
-            callback=callback
-        )
+            routing_key=dest
+        ), callback)
 
     def unbindQueue(self, queue, dest, callback=None):
         logging.debug("Unbinding %s from %s" % (queue, dest))
-        self.channel.queue_unbind(
+        self.pool.topology("queue_unbind", dict(
             exchange="amq.topic",
             queue=queue,
-            routing_key=dest,
-            callback=callback
-        )
+            routing_key=dest
+        ), callback)
 
-    def deleteQueue(self, queue):
+    def deleteQueue(self, queue, callback=None):
         logging.debug("Deleting queue %s" % queue)
-        self.channel.queue_delete(queue=queue)
+        self.pool.forgetQueue(queue)
+        self.pool.topology("queue_delete", dict(queue=queue), callback)
 
     def on_inter_message(self, channel, method, header, body):
         """
-        Process an "inter" message.
+        Process an "inter" message. Recipients are resolved from the routing
+        index, so only online users get the packet dispatched.
+
+        The message is acknowledged once it has been processed.
         """
-        sess = meta.Session()
+        self.inter_unacked += 1
+        self.inter_stats["max_in_flight"] = max(self.inter_stats["max_in_flight"], self.inter_unacked)
+
+        try:
+            self.dispatchInter(method.routing_key, body)
+        except Exception:
+            logging.exception("Failed to process inter message %s: %s" % (method.routing_key, body))
 
-        channel.basic_ack(delivery_tag=method.delivery_tag)
+        self.inter_stats["processed"] += 1
+        self.ackInter(method.delivery_tag)
 
-        prefixparts = method.routing_key.split(".")
+    def dispatchInter(self, routing_key, body):
+        """
+        Dispatch an "inter" message body to its recipients on this node.
+        """
+        # drop the partition number
+        prefixparts = routing_key.split(".")
+        del prefixparts[1]
 
         packet = deserializePacket(body)
         packet._origin = ORIGIN_INTER
 
+        index = self.core.routing
+
         if prefixparts[1] == "global":
-            for user in sess.query(User):
-                packet.dispatch(self.core, FakeSession(user.id))
+            user_ids = index.allUsers()
+        else:
+            ident = uuid.UUID(hex=prefixparts[2])
+
+            if prefixparts[1] == "User":
+                user_ids = index.isOnline(ident) and [ ident ] or []
+            elif prefixparts[1] == "Tile":
+                user_ids = index.usersOnTile(ident)
+            elif prefixparts[1] == "Group":
+                user_ids = index.usersInGroup(ident)
+            elif prefixparts[1] == "Realm":
+                user_ids = index.usersInRealm(ident)
+            else:
+                user_ids = []
+
+        with meta.unitOfWork():
+            for user_id in user_ids:
+                packet.dispatch(self.core, FakeSession(user_id))
+
+    def ackInter(self, delivery_tag):
+        """
+        Acknowledge an "inter" delivery. Acknowledgements are sent as a single
+        multiple ack once ``inter_ack_batch`` deliveries are pending, or at the
+        end of the IOLoop iteration, whichever is sooner.
+
+        :Parameters:
+             * ``delivery_tag``
+               Delivery tag of the processed message.
+        """
+        self.inter_last_tag = delivery_tag
+
+        if self.inter_unacked >= options.inter_ack_batch:
+            self.flushAcks()
+        elif not self.ack_scheduled:
+            self.ack_scheduled = True
+            IOLoop.instance().add_callback(self.flushAcks)
+
+    def flushAcks(self):
+        """
+        Acknowledge every processed "inter" delivery.
+        """
+        self.ack_scheduled = False
+
+        channel = self.pool.get(CHANNEL_INTER)
+
+        if self.inter_last_tag is None or channel is None:
             return
 
-        ident = uuid.UUID(hex=prefixparts[2])
-
-        if prefixparts[1] == "User":
-            user = sess.query(User).get(ident)
-            packet.dispatch(self.core, FakeSession(user.id))
-        elif prefixparts[1] == "Tile":
-            for user in sess.query(User).filter(User.location_id == ident):
-                packet.dispatch(self.core, FakeSession(user.id))
-        elif prefixparts[1] == "Group":
-            for user in sess.query(User).filter(User.group_id == ident):
-                packet.dispatch(self.core, FakeSession(user.id))
-        elif prefixparts[1] == "Realm":
-            for user in sess.query(User).filter(User.location_id == Tile.id).filter(Tile.chunk_id == Chunk.id).filter(Chunk.realm_id == Realm.id).filter(Realm.id == ident):
-                packet.dispatch(self.core, FakeSession(user.id))
+        channel.basic_ack(delivery_tag=self.inter_last_tag, multiple=True)
+
+        self.inter_last_tag = None
+        self.inter_unacked = 0
+        self.inter_stats["acks"] += 1
+
+    def on_inter_channel_lost(self):
+        """
+        Forget about acknowledging deliveries from an inter channel that has
+        gone away. The broker redelivers them.
+        """
+        self.inter_unacked = 0
+        self.inter_last_tag = None
+
+    def interStats(self):
+        """
+        Get "inter" consumer counters: messages processed, acks sent, mean
+        messages per ack, and deliveries currently in flight (received but not
+        yet acknowledged) along with the most seen at once.
+        """
+        stats = self.inter_stats
+
+        return {
+            "processed"     : stats["processed"],
+            "acks"          : stats["acks"],
+            "mean_ack"      : stats["acks"] and float(stats["processed"]) / stats["acks"] or 0.0,
+            "in_flight"     : self.inter_unacked,
+            "max_in_flight" : stats["max_in_flight"]
+        }
 
     def broadcastEx(self, packet):
         self.send("ex.global", packet)
@@ -0,0 +1,369 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Pool of bus channels, one per class of traffic.
+"""
+
+import re
+import time
+import uuid
+import logging
+
+from collections import deque
+
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+CHANNEL_PUBLISH = "publish"
+CHANNEL_INTER = "inter"
+CHANNEL_SESSION = "session"
+CHANNEL_TOPOLOGY = "topology"
+
+TRAFFIC_CLASSES = (CHANNEL_PUBLISH, CHANNEL_INTER, CHANNEL_SESSION, CHANNEL_TOPOLOGY)
+
+NO_QUEUE_EXPR = re.compile(r"no queue '([^']+)'")
+
+class ChannelPool(object):
+    """
+    Keeps one channel open per class of traffic, so a flood on one doesn't
+    hold up the others:
+
+     * ``publish``, for everything the bus publishes.
+     * ``inter``, for consuming inter partitions and other traffic between
+       nodes.
+     * ``session``, for session consumers.
+     * ``topology``, for declaring, binding, unbinding and deleting queues.
+
+    If the broker closes a channel (e.g. because a bind failed), it is
+    reopened and set up again, and its consumers are started again.
+
+    If the whole connection is lost, the pool is opened again on the new
+    connection once the bus reconnects. The queues the broker dropped with the
+    old connection (i.e. the ones that aren't durable) are declared and bound
+    again before any consumers are restarted.
+
+    Topology operations are flow controlled: at most ``bus_topology_window``
+    are waiting on the broker at a time, and the rest are queued.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+        self.connection = None
+        self.channels = {}
+        self.ready = False
+        self.closing = False
+
+        self.consumers = {}
+
+        self.topology_queue = deque()
+        self.topology_inflight = deque()
+
+        # topology that goes away with the connection
+        self.declared = {}
+        self.bindings = set()
+        self.restoring = False
+        self.restore_callback = None
+
+    def open(self, connection):
+        """
+        Open every channel on a connection.
+
+        :Parameters:
+             * ``connection``
+               Connection to the broker.
+        """
+        self.connection = connection
+        self.closing = False
+
+        self.channels = {}
+        self.restoring = bool(self.declared)
+        self.restore_callback = None
+
+        for name in TRAFFIC_CLASSES:
+            self.openChannel(name)
+
+    def close(self):
+        """
+        Stop reopening channels, as the connection is being closed.
+        """
+        self.closing = True
+        self.ready = False
+
+    def lost(self):
+        """
+        Forget every channel, as the connection has been lost.
+        """
+        self.connection = None
+        self.channels = {}
+        self.ready = False
+
+        self.bus.on_publish_channel_lost()
+        self.bus.on_inter_channel_lost()
+
+        # none of these were confirmed, so do them again on the next
+        # connection, except for a restore that will start over anyway
+        self.topology_queue.extendleft(reversed(self.topology_inflight))
+        self.topology_inflight.clear()
+
+        self.topology_queue = deque(op for op in self.topology_queue if op[2] is not self.restore_callback)
+
+    def openChannel(self, name):
+        self.connection.channel(lambda channel: self.on_channel_open(name, channel))
+
+    def get(self, name):
+        """
+        Get the channel for a class of traffic, or ``None`` if it isn't open.
+
+        :Parameters:
+             * ``name``
+               Class of traffic.
+        """
+        return self.channels.get(name)
+
+    def on_channel_open(self, name, channel):
+        self.channels[name] = channel
+        # pika versions differ on whether the channel is passed too
+        channel.add_on_close_callback(lambda *args: self.on_channel_closed(name, channel, *args[-2:]))
+
+        if name == CHANNEL_PUBLISH:
+            if options.amqp_confirms:
+                channel.confirm_delivery(self.bus.on_delivery_confirmation)
+            self.bus.scheduleFlush()
+        elif name == CHANNEL_INTER:
+            # bound the number of unacknowledged deliveries the broker pushes
+            # at us on each inter partition
+            channel.basic_qos(prefetch_count=options.inter_prefetch)
+        elif name == CHANNEL_SESSION:
+            # a session consumer acknowledges a message only once it has
+            # been handed to a client, so this is what bounds its buffer
+            channel.basic_qos(prefetch_count=options.session_buffer_size)
+        elif name == CHANNEL_TOPOLOGY:
+            if self.restoring and self.restore_callback is None:
+                self.restore()
+            else:
+                self.pump()
+
+        if not self.restoring:
+            self._startConsumers(name, channel)
+
+        self._checkReady()
+
+    def _startConsumers(self, name, channel):
+        for ctag, (traffic, queue, callback, no_ack) in self.consumers.items():
+            if traffic == name:
+                self._consume(channel, ctag, queue, callback, no_ack)
+
+    def _checkReady(self):
+        if not self.ready and not self.restoring and len(self.channels) == len(TRAFFIC_CLASSES):
+            self.ready = True
+            self.bus.on_pool_ready()
+
+    def restore(self):
+        """
+        Declare and bind the queues the broker dropped with the old connection,
+        ahead of anything else queued, then restart the consumers.
+        """
+        ops = [ ("queue_declare", kwargs) for kwargs in self.declared.itervalues() ] + \
+              [ ("queue_bind", dict(exchange="amq.topic", queue=queue, routing_key=dest)) for queue, dest in self.bindings ]
+
+        pending = [ len(ops) ]
+
+        def _restored(*args):
+            if self.restore_callback is not _restored:
+                return
+
+            pending[0] -= 1
+            if pending[0]:
+                return
+
+            logging.info("Restored %d queue(s) and %d binding(s)." % (len(self.declared), len(self.bindings)))
+            self.restoring = False
+            self.restore_callback = None
+
+            for name, channel in self.channels.items():
+                self._startConsumers(name, channel)
+
+            self._checkReady()
+
+        self.restore_callback = _restored
+
+        self.topology_queue.extendleft(reversed([ (method, kwargs, _restored) for method, kwargs in ops ]))
+        self.pump()
+
+    def on_channel_closed(self, name, channel, reply_code=None, reply_text=None):
+        if self.closing or self.channels.get(name) is not channel:
+            return
+
+        logging.warn("Bus %s channel closed (%s: %s), reopening." % (name, reply_code, reply_text))
+        del self.channels[name]
+
+        # don't start consuming a queue that's gone again once we reopen
+        match = NO_QUEUE_EXPR.search(reply_text or "")
+        if match is not None:
+            self.forgetQueue(match.group(1))
+
+        if name == CHANNEL_PUBLISH:
+            self.bus.on_publish_channel_lost()
+        elif name == CHANNEL_INTER:
+            self.bus.on_inter_channel_lost()
+        elif name == CHANNEL_TOPOLOGY and self.topology_inflight:
+            # the broker handles a channel's operations in order, so the
+            # oldest one we're still waiting on is the one that failed, and
+            # anything after it was never done
+            failed = self.topology_inflight.popleft()
+            logging.warn("Bus operation failed: %s %r" % (failed[0], failed[1]))
+
+            self.topology_queue.extendleft(reversed(self.topology_inflight))
+            self.topology_inflight.clear()
+
+            # don't leave anything waiting on it stranded
+            if failed[2] is not None:
+                failed[2]()
+
+        # wait a moment, both so a channel that keeps failing doesn't spin
+        # and so we don't reopen on a connection that is going away too
+        connection = self.connection
+
+        def _reopen():
+            if not self.closing and self.connection is connection and name not in self.channels:
+                self.openChannel(name)
+
+        IOLoop.instance().add_timeout(time.time() + 1, _reopen)
+
+    def consume(self, traffic, queue, callback, no_ack=False, consumer_tag=None):
+        """
+        Start a consumer, on the channel for its class of traffic. The consumer
+        is started again if the channel is reopened.
+        """
+        consumer_tag = consumer_tag or uuid.uuid4().hex
+        self.consumers[consumer_tag] = (traffic, queue, callback, no_ack)
+
+        channel = self.get(traffic)
+        if channel is not None:
+            self._consume(channel, consumer_tag, queue, callback, no_ack)
+
+        return consumer_tag
+
+    def _consume(self, channel, consumer_tag, queue, callback, no_ack):
+        channel.basic_consume(
+            consumer_callback=callback,
+            queue=queue,
+            no_ack=no_ack,
+            consumer_tag=consumer_tag
+        )
+
+    def cancel(self, consumer_tag):
+        """
+        Stop a consumer.
+        """
+        consumer = self.consumers.pop(consumer_tag, None)
+        if consumer is None:
+            return
+
+        channel = self.get(consumer[0])
+        if channel is not None:
+            channel.basic_cancel(consumer_tag=consumer_tag)
+
+    def forgetQueue(self, queue):
+        """
+        Forget the consumers of a queue that has been deleted, as the broker
+        cancels them itself.
+        """
+        for ctag, consumer in self.consumers.items():
+            if consumer[1] == queue:
+                del self.consumers[ctag]
+
+    def topology(self, method, kwargs, callback=None):
+        """
+        Queue a topology operation on the topology channel.
+
+        :Parameters:
+             * ``method``
+               Name of the channel method, e.g. ``queue_bind``.
+
+             * ``kwargs``
+               Keyword arguments to the method.
+
+             * ``callback``
+               Function to call once the broker has done it.
+        """
+        self.topology_queue.append((method, kwargs, callback))
+        self.pump()
+
+    def pump(self):
+        """
+        Send queued topology operations while there is room in the window.
+        """
+        channel = self.get(CHANNEL_TOPOLOGY)
+
+        while channel is not None and self.topology_queue and \
+              len(self.topology_inflight) < options.bus_topology_window:
+            op = self.topology_queue.popleft()
+            self.topology_inflight.append(op)
+
+            method, kwargs, callback = op
+            getattr(channel, method)(callback=self._topologyCallback(op), **kwargs)
+
+    def _topologyCallback(self, op):
+        return lambda *args: self.on_topology_done(op, *args)
+
+    def on_topology_done(self, op, *args):
+        if op in self.topology_inflight:
+            self.topology_inflight.remove(op)
+
+        self.track(op[0], op[1])
+        self.pump()
+
+        if op[2] is not None:
+            op[2](*args)
+
+    def track(self, method, kwargs):
+        """
+        Keep track of the queues that aren't durable, and their bindings, so
+        they can be restored on a new connection.
+        """
+        queue = kwargs.get("queue")
+
+        if method == "queue_declare":
+            if not kwargs.get("durable"):
+                self.declared[queue] = kwargs
+        elif method == "queue_bind":
+            if queue in self.declared:
+                self.bindings.add((queue, kwargs["routing_key"]))
+        elif method == "queue_unbind":
+            self.bindings.discard((queue, kwargs["routing_key"]))
+        elif method == "queue_delete":
+            self.declared.pop(queue, None)
+            self.bindings = set(binding for binding in self.bindings if binding[0] != queue)
+
+    def stats(self):
+        """
+        Get channel counters: channels open and topology operations queued and
+        waiting on the broker.
+        """
+        return {
+            "open"          : len(self.channels),
+            "queued"        : len(self.topology_queue),
+            "inflight"      : len(self.topology_inflight)
+        }
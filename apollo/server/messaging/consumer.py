@@ -22,80 +22,369 @@
 
 import logging
 
+import time
 import uuid
 
-from apollo.server.models import meta
-from apollo.server.models.auth import Session
+from collections import deque
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import options
+
+from apollo.server.component import Component
+
+from apollo.server.messaging.channels import CHANNEL_SESSION
+
+from apollo.server.protocol.packet import DELIVERY_LATEST
+from apollo.server.protocol.packet.meta import packetlist
+
+class SessionConsumer(object):
+    """
+    A long-lived consumer on a session's ``ex`` queue. Messages are buffered
+    until a request attached to the consumer drains them.
+
+    A message is only acknowledged once it has been drained and written to
+    the client, so the prefetch count of the session channel
+    (``session_buffer_size``) bounds the buffer. Anything still buffered when
+    the consumer shuts down, or that couldn't be written, is rejected back
+    onto the queue for the next consumer.
+
+    Polls for a session can land on any node, and every node polled keeps its
+    own consumer, so messages this node buffers may be wanted by a poll
+    elsewhere. The consumer is shut down as soon as its last waiter detaches
+    with messages left over, and messages that arrive with nobody attached
+    are given up after ``session_consumer_stranded`` seconds. Both cost a
+    fresh consume on the broker the next time the session is polled here, in
+    return for not holding messages back until ``session_consumer_idle``.
+
+    Buffering a packet whose type has ``DELIVERY_LATEST`` delivery discards
+    (and acknowledges) any older packets of that type still in the buffer.
+    """
+
+    def __init__(self, registry, session_id):
+        self.registry = registry
+        self.session_id = session_id
+
+        self.bus = registry.core.bus
+        self.ctag = uuid.uuid4().hex
+
+        self.buffer = deque()
+        self.waiters = []
+
+        self.last_attached = time.time()
+
+    def start(self):
+        """
+        Begin consuming the session queue.
+        """
+        self.bus.consume("ex:%s" % self.session_id, self.on_message, consumer_tag=self.ctag, traffic=CHANNEL_SESSION)
+
+        logging.debug("Created session consumer for %s" % self.session_id)
+
+    def shutdown(self):
+        """
+        Stop consuming the session queue. Anything left in the buffer is
+        requeued.
+        """
+        logging.debug("Shutting down session consumer for %s" % self.session_id)
+        self.bus.cancel(self.ctag)
+
+        while self.buffer:
+            packet_type, body, channel, delivery_tag = self.buffer.popleft()
+            if self._live(channel):
+                channel.basic_reject(delivery_tag=delivery_tag, requeue=True)
+
+    def _live(self, channel):
+        # the broker requeues everything unacknowledged on a channel that
+        # closes, and delivery tags don't carry over to its replacement
+        return self.bus.pool.get(CHANNEL_SESSION) is channel
+
+    def attach(self, waiter):
+        """
+        Attach a waiter (i.e. a ``Consumer``) to the buffer.
+
+        :Parameters:
+             * ``waiter``
+               Waiter to notify when messages arrive.
+        """
+        self.waiters.append(waiter)
+        self.last_attached = time.time()
+
+    def detach(self, waiter):
+        """
+        Detach a waiter from the buffer.
+
+        :Parameters:
+             * ``waiter``
+               Waiter to detach.
+        """
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        self.last_attached = time.time()
+
+        # what's left may be wanted by a poll on another node
+        if not self.waiters and self.buffer:
+            self.registry.release(self.session_id)
+
+    def drain(self, num=None):
+        """
+        Remove and return up to ``num`` buffered messages, oldest first. Each
+        is a tuple of the packet type, body, channel and delivery tag, and
+        must be passed to ``ack`` once written or ``requeue`` if it couldn't
+        be.
+
+        :Parameters:
+             * ``num``
+               Maximum number of messages to drain (all of them if ``None``).
+        """
+        entries = []
+        while self.buffer and (num is None or len(entries) < num):
+            entry = self.buffer.popleft()
+
+            # it'll be redelivered
+            if not self._live(entry[2]):
+                continue
+
+            entries.append(entry)
+        return entries
+
+    def ack(self, entries):
+        """
+        Acknowledge drained messages that have been written.
+
+        :Parameters:
+             * ``entries``
+               Messages, as returned by ``drain``.
+        """
+        for packet_type, body, channel, delivery_tag in entries:
+            if self._live(channel):
+                channel.basic_ack(delivery_tag=delivery_tag)
+
+    def requeue(self, entries):
+        """
+        Reject drained messages that couldn't be written back onto the queue.
+
+        :Parameters:
+             * ``entries``
+               Messages, as returned by ``drain``.
+        """
+        for packet_type, body, channel, delivery_tag in entries:
+            if self._live(channel):
+                channel.basic_reject(delivery_tag=delivery_tag, requeue=True)
+
+    def idle(self):
+        """
+        Check if the consumer has had no waiters for longer than
+        ``session_consumer_idle`` seconds.
+        """
+        return not self.waiters and time.time() - self.last_attached > options.session_consumer_idle
+
+    def stranded(self):
+        """
+        Check if the consumer has buffered messages and has had no waiters for
+        longer than ``session_consumer_stranded`` seconds.
+        """
+        return bool(self.buffer) and not self.waiters and time.time() - self.last_attached > options.session_consumer_stranded
+
+    def on_message(self, channel, method, header, body):
+        """
+        Handle a message.
+        """
+        logging.debug("Got packet: %s" % body)
+
+        prefixparts = method.routing_key.split(".")
+
+        if prefixparts[0] != "ex":
+            # this is not an ex frame
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        if len(self.buffer) >= options.session_buffer_size:
+            # only if the prefetch count isn't holding the broker back
+            logging.warn("Buffer for %s is full, requeueing packet: %s" % (self.session_id, body))
+            channel.basic_reject(delivery_tag=method.delivery_tag, requeue=True)
+            return
+
+        packet_type = packetlist.get(header.type)
+
+        if packet_type is not None and packet_type.delivery == DELIVERY_LATEST:
+            kept = deque()
+
+            for entry in self.buffer:
+                if entry[0] != header.type:
+                    kept.append(entry)
+                elif self._live(entry[2]):
+                    entry[2].basic_ack(delivery_tag=entry[3])
+
+            self.buffer = kept
+
+        self.buffer.append((header.type, body, channel, method.delivery_tag))
+
+        for waiter in self.waiters[:]:
+            waiter.notify()
+
+class SessionConsumerRegistry(Component):
+    """
+    Registry of session consumers on this node. Keeps one consumer per active
+    session so requests don't have to consume and cancel on the broker for
+    every poll.
+    """
+
+    def __init__(self, core):
+        super(SessionConsumerRegistry, self).__init__(core)
+        self.consumers = {}
+
+    def acquire(self, session_id):
+        """
+        Get the session consumer for a session, starting it if required.
+
+        :Parameters:
+             * ``session_id``
+               ID of the session.
+        """
+        if session_id not in self.consumers:
+            consumer = SessionConsumer(self, session_id)
+            consumer.start()
+            self.consumers[session_id] = consumer
+        return self.consumers[session_id]
+
+    def release(self, session_id):
+        """
+        Shut down the session consumer for a session, if there is one.
+
+        :Parameters:
+             * ``session_id``
+               ID of the session.
+        """
+        consumer = self.consumers.pop(session_id, None)
+        if consumer is not None:
+            consumer.shutdown()
+
+    def sweep(self):
+        """
+        Shut down session consumers nobody has attached to in a while, and
+        those holding messages nobody here is polling for.
+        """
+        for session_id, consumer in self.consumers.items():
+            if consumer.idle() or consumer.stranded():
+                self.release(session_id)
+
+    def go(self):
+        """
+        Start the sweep cycle.
+        """
+        self.callback = PeriodicCallback(self.sweep, min(options.session_consumer_idle, options.session_consumer_stranded) * 1000)
+        self.callback.start()
 
 class Consumer(object):
     """
-    Consumer object. These are actually one-time use only.
+    Consumer object. These are actually one-time use only: they attach to the
+    session consumer, drain a batch from it and detach.
     """
 
     def __init__(self, handler):
         self.handler = handler
 
-        self.bus = handler.application.bus
-        self.channel = self.bus.channel
-        self.ctag = uuid.uuid4().hex
+        self.registry = handler.application.consumers
+
+        self.session = None
+        self.source = None
 
-        self.rejecting = False
+        self.flush_timeout = None
 
     def eat(self):
         """
         Begin consuming events.
         """
-        sess = meta.Session()
         token = uuid.UUID(hex=self.handler.token)
 
-        self.session = sess.query(Session).get(token)
+        self.session = self.handler.application.session_cache.get(token)
 
         if self.session is None:
             logging.warn("Session %s does not exist; bailing" % token)
             return
 
-        self.channel.basic_consume(
-            consumer_callback=self.on_message,
-            queue="ex:%s" % self.session.id,
-            no_ack=False,
-            consumer_tag=self.ctag
-        )
+        self.handler.application.presence.touch(self.session.id)
 
-        logging.debug("Created consumer for %s" % self.session.id)
+        self.source = self.registry.acquire(self.session.id)
+        self.source.attach(self)
+
+        # anything already buffered has waited long enough
+        if self.source.buffer:
+            self.flush()
 
     def shutdown(self):
         """
         Shut down the consumer.
         """
-        self.rejecting = True
+        if self.flush_timeout is not None:
+            IOLoop.instance().remove_timeout(self.flush_timeout)
+            self.flush_timeout = None
 
-        logging.debug("Shutting down consumer for %s" % self.session.id)
-        self.channel.basic_cancel(consumer_tag=self.ctag)
+        if self.source is not None:
+            self.source.detach(self)
 
-    def on_message(self, channel, method, header, body):
+    def notify(self):
         """
-        Handle a message.
+        Called by the session consumer when a message has been buffered. The
+        batch is flushed once it reaches ``events_batch_size`` or
+        ``events_linger`` milliseconds after the first message arrived,
+        whichever is sooner.
         """
-        logging.debug("Got packet: %s" % body)
+        if len(self.source.buffer) >= options.events_batch_size:
+            self.flush()
+        elif self.flush_timeout is None:
+            self.flush_timeout = IOLoop.instance().add_timeout(
+                time.time() + options.events_linger / 1000.0,
+                self.flush
+            )
 
-        if self.rejecting:
-            logging.info("Rejecting packet: %s" % body)
-            channel.basic_reject(delivery_tag=method.delivery_tag)
-            return
+    def flush(self):
+        """
+        Send the buffered message bodies to the handler as a JSON array.
+        """
+        if self.flush_timeout is not None:
+            IOLoop.instance().remove_timeout(self.flush_timeout)
+            self.flush_timeout = None
 
-        channel.basic_ack(delivery_tag=method.delivery_tag)
-        prefixparts = method.routing_key.split(".")
+        source = self.source
 
-        if prefixparts[0] != "ex":
-            # this is not an ex frame
+        entries = source.drain(options.events_batch_size)
+        if not entries:
             return
 
+        # we most definitely don't want any more stuff
+        self.shutdown()
+
+        body = "[%s]" % ",".join(entry[1] for entry in entries)
+
         try:
             self.handler.finish(body)
         except IOError:
-            logging.warn("Dropped packet due to closed request: %s" % body)
+            logging.warn("Requeued packets due to closed request: %s" % body)
+            source.requeue(entries)
+        else:
+            source.ack(entries)
 
-        # shut down now, because we most definitely don't want any more stuff
-        # (but we tend to get stuff anyway, which is why we have a rejecting
-        # field)
-        self.shutdown()
+class StreamConsumer(Consumer):
+    """
+    Consumer object that stays attached to the session consumer for the
+    lifetime of a persistent connection (i.e. a WebSocket).
+    """
+
+    def notify(self):
+        self.flush()
+
+    def flush(self):
+        entries = self.source.drain()
+        if not entries:
+            return
+
+        body = "[%s]" % ",".join(entry[1] for entry in entries)
+
+        try:
+            self.handler.write_message(body)
+        except IOError:
+            logging.warn("Requeued packets due to closed stream: %s" % body)
+            self.source.requeue(entries)
+        else:
+            self.source.ack(entries)
@@ -0,0 +1,258 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Node-local index of online users for routing inter messages.
+"""
+
+import json
+import uuid
+import logging
+
+from apollo.server.component import Component
+
+from apollo.server.models import meta
+from apollo.server.models.auth import User
+from apollo.server.models.geography import Tile, Chunk
+
+from apollo.server.protocol.packet import DELIVERY_TRANSIENT
+
+class RoutingIndex(Component):
+    """
+    Index of online users by tile, group and realm, so inter messages can be
+    fanned out without querying the database.
+
+    Each node loads the index from the database when its bus becomes ready.
+    After that, changes are applied locally straight away and announced to
+    every other node over the bus.
+    """
+
+    def __init__(self, core):
+        super(RoutingIndex, self).__init__(core)
+
+        self.users = {}
+
+        self.by_tile = {}
+        self.by_group = {}
+        self.by_realm = {}
+
+    def go(self):
+        """
+        Start listening for index changes from other nodes and load the
+        index.
+        """
+        self.core.bus.onReady(self.on_bus_ready)
+        self.core.bus.onReconnect(self.reload)
+
+    def on_bus_ready(self):
+        queue = "index:%s" % self.core.bus.busName
+        self.core.bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_update, no_ack=True)
+        bus.bindQueue(queue, "index.#", lambda *args: self.load())
+
+    def load(self):
+        """
+        Load the index from the database.
+        """
+        sess = meta.Session()
+
+        for user_id, tile_id, group_id, realm_id in sess.query(User.id, User.location_id, User.group_id, Chunk.realm_id) \
+            .filter(User.online == True) \
+            .filter(User.location_id == Tile.id) \
+            .filter(Tile.chunk_id == Chunk.id):
+            self._add(user_id, tile_id, group_id, realm_id)
+
+        logging.info("Routing index loaded with %d online user(s)." % len(self.users))
+
+    def reload(self):
+        """
+        Throw the index away and load it again, e.g. after missing changes
+        while the bus was down.
+        """
+        self.users = {}
+
+        self.by_tile = {}
+        self.by_group = {}
+        self.by_realm = {}
+
+        self.load()
+
+    def _add(self, user_id, tile_id, group_id, realm_id):
+        self._remove(user_id)
+
+        self.users[user_id] = (tile_id, group_id, realm_id)
+
+        self.by_tile.setdefault(tile_id, set()).add(user_id)
+        self.by_group.setdefault(group_id, set()).add(user_id)
+        self.by_realm.setdefault(realm_id, set()).add(user_id)
+
+    def _remove(self, user_id):
+        if user_id not in self.users:
+            return
+
+        tile_id, group_id, realm_id = self.users.pop(user_id)
+
+        for index, key in ((self.by_tile, tile_id), (self.by_group, group_id), (self.by_realm, realm_id)):
+            index[key].discard(user_id)
+            if not index[key]:
+                del index[key]
+
+    def _announce(self, op, user_id, *args):
+        self.core.bus.publish(
+            "index.%s.%s" % (op, self.core.bus.busName),
+            json.dumps([ user_id.hex ] + [ arg.hex for arg in args ]),
+            DELIVERY_TRANSIENT
+        )
+
+    def online(self, user_id, tile_id, group_id, realm_id):
+        """
+        Add an online user to the index.
+
+        :Parameters:
+             * ``user_id``
+               ID of the user.
+
+             * ``tile_id``
+               ID of the tile the user is on.
+
+             * ``group_id``
+               ID of the group the user is in.
+
+             * ``realm_id``
+               ID of the realm the user is in.
+        """
+        self._add(user_id, tile_id, group_id, realm_id)
+        self._announce("online", user_id, tile_id, group_id, realm_id)
+
+    def moved(self, user_id, tile_id, realm_id):
+        """
+        Move an online user to another tile.
+
+        :Parameters:
+             * ``user_id``
+               ID of the user.
+
+             * ``tile_id``
+               ID of the tile the user moved to.
+
+             * ``realm_id``
+               ID of the realm the tile is in.
+        """
+        if user_id not in self.users:
+            return
+
+        self._add(user_id, tile_id, self.users[user_id][1], realm_id)
+        self._announce("moved", user_id, tile_id, realm_id)
+
+    def offline(self, user_id):
+        """
+        Remove a user that went offline from the index.
+
+        :Parameters:
+             * ``user_id``
+               ID of the user.
+        """
+        self._remove(user_id)
+        self._announce("offline", user_id)
+
+    def on_update(self, channel, method, header, body):
+        """
+        Apply an index change announced by another node.
+        """
+        prefixparts = method.routing_key.split(".")
+
+        if prefixparts[2] == self.core.bus.busName:
+            # we applied our own changes already
+            return
+
+        op = prefixparts[1]
+        args = [ uuid.UUID(hex=arg) for arg in json.loads(body) ]
+
+        if op == "online":
+            self._add(*args)
+        elif op == "moved":
+            user_id, tile_id, realm_id = args
+            if user_id in self.users:
+                self._add(user_id, tile_id, self.users[user_id][1], realm_id)
+        elif op == "offline":
+            self._remove(*args)
+
+    def locationOf(self, user_id):
+        """
+        Get the IDs of an online user's tile, group and realm, as a tuple, or
+        ``None`` if the user isn't online.
+
+        :Parameters:
+             * ``user_id``
+               ID of the user.
+        """
+        return self.users.get(user_id)
+
+    def allUsers(self):
+        """
+        Get the IDs of all online users.
+        """
+        return self.users.keys()
+
+    def isOnline(self, user_id):
+        """
+        Check if a user is online.
+
+        :Parameters:
+             * ``user_id``
+               ID of the user.
+        """
+        return user_id in self.users
+
+    def usersOnTile(self, tile_id):
+        """
+        Get the IDs of all online users on a tile.
+
+        :Parameters:
+             * ``tile_id``
+               ID of the tile.
+        """
+        return list(self.by_tile.get(tile_id, ()))
+
+    def usersInGroup(self, group_id):
+        """
+        Get the IDs of all online users in a group.
+
+        :Parameters:
+             * ``group_id``
+               ID of the group.
+        """
+        return list(self.by_group.get(group_id, ()))
+
+    def usersInRealm(self, realm_id):
+        """
+        Get the IDs of all online users in a realm.
+
+        :Parameters:
+             * ``realm_id``
+               ID of the realm.
+        """
+        return list(self.by_realm.get(realm_id, ()))
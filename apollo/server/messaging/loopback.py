@@ -0,0 +1,405 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+In-process message bus backend.
+
+Stands in for a pika ``TornadoConnection`` and its channel, routing messages
+between queues in memory with the semantics of the ``amq.topic`` exchange.
+Everything is delivered on the IOLoop, as it would be from a broker, so the
+rest of the server can't tell the difference. Only one process can use it.
+"""
+
+import uuid
+import logging
+
+from collections import deque
+
+from tornado.ioloop import IOLoop
+
+from pika import BasicProperties, spec, frame
+
+def topicMatches(pattern, key):
+    """
+    Check if a routing key matches a topic binding pattern. ``*`` matches
+    exactly one word and ``#`` matches zero or more.
+
+    :Parameters:
+         * ``pattern``
+           Binding pattern, as a list of words.
+
+         * ``key``
+           Routing key, as a list of words.
+    """
+    if not pattern:
+        return not key
+
+    head = pattern[0]
+
+    if head == "#":
+        for i in xrange(len(key) + 1):
+            if topicMatches(pattern[1:], key[i:]):
+                return True
+        return False
+
+    if not key:
+        return False
+
+    return (head == "*" or head == key[0]) and topicMatches(pattern[1:], key[1:])
+
+class LoopbackConsumer(object):
+    """
+    A consumer on a loopback queue.
+    """
+
+    def __init__(self, channel, queue, callback, no_ack, tag):
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.no_ack = no_ack
+        self.tag = tag
+
+        # basic.qos applies to consumers started after it
+        self.prefetch = channel.prefetch
+        self.unacked = 0
+
+    def ready(self):
+        """
+        Check if the consumer can take another delivery.
+        """
+        return self.no_ack or not self.prefetch or self.unacked < self.prefetch
+
+class LoopbackQueue(object):
+    """
+    A queue on the loopback broker.
+    """
+
+    def __init__(self, name, owner=None, auto_delete=False, max_length=None):
+        self.name = name
+        self.owner = owner
+        self.auto_delete = auto_delete
+
+        # like x-max-length, the oldest messages are dropped
+        self.messages = deque(maxlen=max_length)
+        self.consumers = []
+        self.bindings = set()
+
+        self.dispatch_scheduled = False
+
+class LoopbackBroker(object):
+    """
+    In-memory broker holding every loopback queue and binding in the process.
+    """
+
+    def __init__(self):
+        self.queues = {}
+
+    def declare(self, name, owner=None, auto_delete=False, max_length=None):
+        if name not in self.queues:
+            self.queues[name] = LoopbackQueue(name, owner, auto_delete, max_length)
+        return self.queues[name]
+
+    def delete(self, name):
+        queue = self.queues.pop(name, None)
+        if queue is not None:
+            for consumer in queue.consumers:
+                consumer.channel.consumers.pop(consumer.tag, None)
+        return queue
+
+    def dropConnection(self, connection):
+        """
+        Delete the exclusive queues owned by a connection.
+        """
+        for name, queue in self.queues.items():
+            if queue.owner is connection:
+                self.delete(name)
+
+    def route(self, routing_key):
+        """
+        Get the queues a routing key is delivered to.
+        """
+        key = routing_key.split(".")
+
+        return [
+            queue for queue in self.queues.itervalues()
+            if any(topicMatches(pattern.split("."), key) for pattern in queue.bindings)
+        ]
+
+    def publish(self, routing_key, body, properties):
+        for queue in self.route(routing_key):
+            queue.messages.append((routing_key, body, properties))
+            self.scheduleDispatch(queue)
+
+    def scheduleDispatch(self, queue):
+        if not queue.dispatch_scheduled:
+            queue.dispatch_scheduled = True
+            IOLoop.instance().add_callback(lambda: self.dispatch(queue))
+
+    def dispatch(self, queue):
+        """
+        Deliver a queue's messages to its consumers, round-robin, until it is
+        empty or every consumer is at its prefetch limit.
+        """
+        queue.dispatch_scheduled = False
+
+        while queue.messages and self.queues.get(queue.name) is queue:
+            ready = [ consumer for consumer in queue.consumers if consumer.ready() ]
+            if not ready:
+                return
+
+            for consumer in ready:
+                if not queue.messages or self.queues.get(queue.name) is not queue:
+                    break
+
+                # an earlier delivery in this round may have cancelled it
+                if consumer not in queue.consumers:
+                    continue
+
+                routing_key, body, properties = queue.messages.popleft()
+                consumer.channel.deliver(consumer, routing_key, body, properties)
+
+class LoopbackChannel(object):
+    """
+    Stands in for a pika channel. Implements the subset of the channel API the
+    server uses.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+
+        self.prefetch = 0
+        self.consumers = {}
+
+        self.delivery_tag = 0
+        self.unacked = {}
+
+        self.confirm_callback = None
+        self.publish_seq = 0
+
+        self.close_callbacks = []
+
+    def _reply(self, callback, method):
+        if callback is not None:
+            IOLoop.instance().add_callback(lambda: callback(frame.Method(1, method)))
+
+    def _fail(self, reply_code, reply_text):
+        """
+        Close the channel on an error, as the broker would.
+        """
+        logging.warn("Loopback channel closed (%d: %s)" % (reply_code, reply_text))
+        self.close()
+
+        for callback in self.close_callbacks:
+            IOLoop.instance().add_callback(lambda callback=callback: callback(reply_code, reply_text))
+
+    def add_on_close_callback(self, callback):
+        self.close_callbacks.append(callback)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_=False):
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self, callback=None, nowait=False):
+        self.confirm_callback = callback
+
+    def queue_declare(self, callback=None, queue="", passive=False, durable=False,
+                      exclusive=False, auto_delete=False, nowait=False, arguments=None):
+        queue = self.broker.declare(
+            queue or "amq.gen-%s" % uuid.uuid4().hex,
+            exclusive and self.connection or None,
+            auto_delete,
+            (arguments or {}).get("x-max-length")
+        )
+
+        self._reply(callback, spec.Queue.DeclareOk(
+            queue=queue.name,
+            message_count=len(queue.messages),
+            consumer_count=len(queue.consumers)
+        ))
+
+    def queue_bind(self, callback=None, queue="", exchange=None, routing_key=None,
+                   nowait=False, arguments=None):
+        if exchange != "amq.topic":
+            raise ValueError("The loopback bus only has the amq.topic exchange")
+
+        if queue not in self.broker.queues:
+            self._fail(404, "NOT_FOUND - no queue '%s'" % queue)
+            return
+
+        self.broker.queues[queue].bindings.add(routing_key)
+
+        self._reply(callback, spec.Queue.BindOk())
+
+    def queue_unbind(self, callback=None, queue="", exchange=None, routing_key=None,
+                     arguments=None):
+        if queue in self.broker.queues:
+            self.broker.queues[queue].bindings.discard(routing_key)
+
+        self._reply(callback, spec.Queue.UnbindOk())
+
+    def queue_delete(self, callback=None, queue="", if_unused=False, if_empty=False,
+                     nowait=False):
+        queue = self.broker.delete(queue)
+
+        self._reply(callback, spec.Queue.DeleteOk(
+            message_count=queue is not None and len(queue.messages) or 0
+        ))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False,
+                      immediate=False):
+        if exchange != "amq.topic":
+            raise ValueError("The loopback bus only has the amq.topic exchange")
+
+        self.broker.publish(routing_key, body, properties or BasicProperties())
+
+        if self.confirm_callback is not None:
+            self.publish_seq += 1
+            self._reply(self.confirm_callback, spec.Basic.Ack(delivery_tag=self.publish_seq))
+
+    def basic_consume(self, consumer_callback, queue="", no_ack=False, exclusive=False,
+                      consumer_tag=None):
+        if queue not in self.broker.queues:
+            self._fail(404, "NOT_FOUND - no queue '%s'" % queue)
+            return
+
+        consumer_tag = consumer_tag or uuid.uuid4().hex
+        consumer = LoopbackConsumer(self, self.broker.queues[queue], consumer_callback, no_ack, consumer_tag)
+
+        self.consumers[consumer_tag] = consumer
+        consumer.queue.consumers.append(consumer)
+
+        self.broker.scheduleDispatch(consumer.queue)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag="", nowait=False, callback=None):
+        consumer = self.consumers.pop(consumer_tag, None)
+
+        if consumer is not None:
+            queue = consumer.queue
+            if consumer in queue.consumers:
+                queue.consumers.remove(consumer)
+
+            if queue.auto_delete and not queue.consumers:
+                self.broker.delete(queue.name)
+
+        self._reply(callback, spec.Basic.CancelOk(consumer_tag=consumer_tag))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        if multiple:
+            tags = [ tag for tag in self.unacked if tag <= delivery_tag ]
+        else:
+            tags = [ delivery_tag ]
+
+        for tag in tags:
+            if tag not in self.unacked:
+                logging.warn("Acknowledged unknown delivery tag %d" % tag)
+                continue
+
+            consumer, message = self.unacked.pop(tag)
+            consumer.unacked -= 1
+            self.broker.scheduleDispatch(consumer.queue)
+
+    def basic_reject(self, delivery_tag=None, requeue=True):
+        if delivery_tag not in self.unacked:
+            logging.warn("Rejected unknown delivery tag %d" % delivery_tag)
+            return
+
+        consumer, message = self.unacked.pop(delivery_tag)
+        consumer.unacked -= 1
+
+        if requeue and self.broker.queues.get(consumer.queue.name) is consumer.queue:
+            consumer.queue.messages.appendleft(message)
+
+        self.broker.scheduleDispatch(consumer.queue)
+
+    def deliver(self, consumer, routing_key, body, properties):
+        """
+        Deliver a message to one of this channel's consumers.
+        """
+        self.delivery_tag += 1
+
+        if not consumer.no_ack:
+            consumer.unacked += 1
+            self.unacked[self.delivery_tag] = (consumer, (routing_key, body, properties))
+
+        method = spec.Basic.Deliver(
+            consumer_tag=consumer.tag,
+            delivery_tag=self.delivery_tag,
+            redelivered=False,
+            exchange="amq.topic",
+            routing_key=routing_key
+        )
+
+        try:
+            consumer.callback(self, method, properties, body)
+        except Exception:
+            logging.exception("Consumer %s failed on message to %s" % (consumer.tag, routing_key))
+
+    def close(self):
+        for consumer_tag in self.consumers.keys():
+            self.basic_cancel(consumer_tag)
+
+        # requeue everything that wasn't acknowledged, in order
+        for tag in sorted(self.unacked, reverse=True):
+            consumer, message = self.unacked[tag]
+            consumer.unacked -= 1
+
+            if self.broker.queues.get(consumer.queue.name) is consumer.queue:
+                consumer.queue.messages.appendleft(message)
+                self.broker.scheduleDispatch(consumer.queue)
+
+        self.unacked = {}
+
+class LoopbackConnection(object):
+    """
+    Stands in for a pika ``TornadoConnection``.
+    """
+
+    def __init__(self, on_open_callback=None, broker=None):
+        self.broker = broker or _broker
+
+        self.channels = []
+        self.close_callbacks = []
+
+        if on_open_callback is not None:
+            IOLoop.instance().add_callback(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback):
+        channel = LoopbackChannel(self)
+        self.channels.append(channel)
+
+        IOLoop.instance().add_callback(lambda: on_open_callback(channel))
+
+    def add_on_close_callback(self, callback):
+        self.close_callbacks.append(callback)
+
+    def close(self, code=200, text="Normal shutdown"):
+        for channel in self.channels:
+            channel.close()
+        self.channels = []
+
+        self.broker.dropConnection(self)
+
+        for callback in self.close_callbacks:
+            IOLoop.instance().add_callback(lambda callback=callback: callback(self, code, text))
+
+_broker = LoopbackBroker()
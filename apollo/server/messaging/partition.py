@@ -0,0 +1,272 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Partitioning of inter traffic between nodes.
+
+Inter messages are spread over ``inter_partitions`` queues by a hash of their
+entity (e.g. ``Tile.<id>``), so every message for one entity goes through the
+same queue, in order. Each partition is consumed by exactly one node at a time,
+picked by rendezvous hashing over the nodes currently alive.
+"""
+
+import time
+import zlib
+import hashlib
+import logging
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import options
+
+from apollo.server.component import Component
+
+from apollo.server.protocol.packet import DELIVERY_TRANSIENT
+
+def partitionOf(entity):
+    """
+    Get the partition an entity's inter messages go through.
+
+    :Parameters:
+         * ``entity``
+           Entity part of the routing key, e.g. ``Tile.<id>`` or ``global``.
+    """
+    return (zlib.crc32(entity) & 0xffffffff) % options.inter_partitions
+
+def partitionKey(dest):
+    """
+    Rewrite an inter routing key (``inter.<entity>``) to include its partition
+    (``inter.<partition>.<entity>``).
+
+    :Parameters:
+         * ``dest``
+           Inter routing key.
+    """
+    entity = dest[len("inter."):]
+    return "inter.%d.%s" % (partitionOf(entity), entity)
+
+def partitionOwner(partition, nodes):
+    """
+    Pick the node that should consume a partition.
+
+    :Parameters:
+         * ``partition``
+           Partition number.
+
+         * ``nodes``
+           Names of the nodes alive.
+    """
+    return max(nodes, key=lambda node: hashlib.md5("%s:%d" % (node, partition)).digest())
+
+class PartitionManager(Component):
+    """
+    Keeps track of the nodes alive and claims this node's share of the inter
+    partitions, rebalancing whenever a node joins or leaves.
+
+    Nodes announce themselves over ``members.*`` on the bus every
+    ``partition_heartbeat`` seconds, and are considered gone after missing
+    three heartbeats or announcing that they are leaving.
+
+    Partition queues are declared with a single active consumer, so while
+    ownership is being handed over the broker still only delivers each
+    partition to one node.
+    """
+
+    def __init__(self, core):
+        super(PartitionManager, self).__init__(core)
+
+        self.nodes = {}
+        self.owned = {}
+        self.consuming = set()
+
+        self.rebalance_timeout = None
+
+    def go(self):
+        """
+        Join the cluster once the bus is ready.
+        """
+        self.core.bus.onReady(self.on_bus_ready)
+
+    def stop(self):
+        """
+        Give up every partition and tell the other nodes we are leaving.
+        """
+        if hasattr(self, "callback"):
+            self.callback.stop()
+
+        for partition in self.owned.keys():
+            self.release(partition)
+
+        self._announce("leave")
+
+    def on_bus_ready(self):
+        queue = "members:%s" % self.core.bus.busName
+        self.core.bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_member, no_ack=True)
+        bus.bindQueue(queue, "members.#", lambda *args: self._announce("join"))
+
+        self.nodes[bus.busName] = time.time()
+        self.scheduleRebalance()
+
+        self.callback = PeriodicCallback(self.heartbeat, options.partition_heartbeat * 1000)
+        self.callback.start()
+
+    def _announce(self, op):
+        self.core.bus.publish("members.%s.%s" % (op, self.core.bus.busName), "", DELIVERY_TRANSIENT)
+
+    def heartbeat(self):
+        """
+        Announce that this node is alive and forget nodes that have stopped
+        announcing themselves.
+        """
+        self._announce("alive")
+
+        now = time.time()
+        self.nodes[self.core.bus.busName] = now
+
+        for node, last_seen in self.nodes.items():
+            if now - last_seen > options.partition_heartbeat * 3:
+                logging.info("Node %s timed out." % node)
+                del self.nodes[node]
+                self.scheduleRebalance()
+
+    def on_member(self, channel, method, header, body):
+        """
+        Handle a membership announcement.
+        """
+        prefixparts = method.routing_key.split(".")
+        op, node = prefixparts[1], prefixparts[2]
+
+        if node == self.core.bus.busName:
+            return
+
+        if op == "leave":
+            if self.nodes.pop(node, None) is not None:
+                logging.info("Node %s left." % node)
+                self.scheduleRebalance()
+            return
+
+        if node not in self.nodes:
+            logging.info("Node %s joined." % node)
+            self.scheduleRebalance()
+
+            # let the new node know about us straight away
+            if op == "join":
+                self._announce("alive")
+
+        self.nodes[node] = time.time()
+
+    def scheduleRebalance(self):
+        """
+        Rebalance partitions shortly, so a burst of membership changes only
+        causes one rebalance.
+        """
+        if self.rebalance_timeout is None:
+            self.rebalance_timeout = IOLoop.instance().add_timeout(time.time() + 1, self.rebalance)
+
+    def rebalance(self):
+        """
+        Claim the partitions this node should own and release the rest.
+        """
+        self.rebalance_timeout = None
+
+        if self.core.bus.busName not in self.nodes:
+            return
+
+        nodes = self.nodes.keys()
+
+        for partition in xrange(options.inter_partitions):
+            mine = partitionOwner(partition, nodes) == self.core.bus.busName
+
+            if mine and partition not in self.owned:
+                self.claim(partition)
+            elif not mine and partition in self.owned:
+                self.release(partition)
+
+        logging.info("Consuming %d of %d inter partition(s) across %d node(s)." % (len(self.owned), options.inter_partitions, len(nodes)))
+
+    def claim(self, partition):
+        """
+        Start consuming a partition.
+
+        :Parameters:
+             * ``partition``
+               Partition number.
+        """
+        bus = self.core.bus
+        queue = "inter:%d" % partition
+        ctag = "%s:%d" % (bus.busName, partition)
+
+        self.owned[partition] = ctag
+
+        def _declared(*args):
+            # released again before the broker got back to us
+            if self.owned.get(partition) != ctag:
+                return
+
+            bus.consume(queue, bus.on_inter_message, consumer_tag=ctag)
+            self.consuming.add(ctag)
+            bus.bindQueue(queue, "inter.%d.#" % partition)
+
+        bus.declareQueue(queue, _declared, durable=True, arguments={
+            "x-single-active-consumer" : True
+        })
+
+    def release(self, partition):
+        """
+        Stop consuming a partition. Everything processed from it so far is
+        acknowledged first, so the next owner carries on in order.
+
+        :Parameters:
+             * ``partition``
+               Partition number.
+        """
+        ctag = self.owned.pop(partition)
+
+        if ctag in self.consuming:
+            self.consuming.discard(ctag)
+            self.core.bus.flushAcks()
+            self.core.bus.cancel(ctag)
+
+    def owns(self, entity):
+        """
+        Check if this node consumes an entity's inter messages, e.g. to decide
+        whether to keep it in a node-local cache.
+
+        :Parameters:
+             * ``entity``
+               Entity part of the routing key, e.g. ``Tile.<id>``.
+        """
+        return partitionOf(entity) in self.owned
+
+    def stats(self):
+        """
+        Get partition counters: partitions owned, total and nodes alive.
+        """
+        return {
+            "owned"         : len(self.owned),
+            "partitions"    : options.inter_partitions,
+            "nodes"         : len(self.nodes)
+        }
@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Concurrent queue topology changes.
+"""
+
+import time
+import logging
+
+class BindPipeline(object):
+    """
+    A batch of queue binds, unbinds and deletes that are all sent to the
+    broker at once. The callback passed to ``run`` is called once the broker
+    has confirmed every one of them, so a multi-bind operation costs one round
+    trip instead of one per bind.
+
+    Chained calls build up the pipeline, e.g.::
+
+        BindPipeline(bus, "login") \\
+            .bind(queue, "ex.global") \\
+            .bind(queue, user.exRoutingKey()) \\
+            .run(callback)
+    """
+
+    def __init__(self, bus, name):
+        """
+        :Parameters:
+             * ``bus``
+               Bus to run the pipeline on.
+
+             * ``name``
+               Name of the pipeline, which its timings are recorded under.
+        """
+        self.bus = bus
+        self.name = name
+
+        self.ops = []
+        self.timings = {}
+
+    def bind(self, queue, dest):
+        """
+        Add a queue bind to the pipeline.
+        """
+        self.ops.append(("bind", queue, dest))
+        return self
+
+    def unbind(self, queue, dest):
+        """
+        Add a queue unbind to the pipeline.
+        """
+        self.ops.append(("unbind", queue, dest))
+        return self
+
+    def delete(self, queue):
+        """
+        Add a queue delete to the pipeline.
+        """
+        self.ops.append(("delete", queue, None))
+        return self
+
+    def run(self, callback=None):
+        """
+        Send every operation to the broker.
+
+        :Parameters:
+             * ``callback``
+               Function to call once every operation has been confirmed.
+        """
+        started = time.time()
+        pending = set(xrange(len(self.ops)))
+
+        def _finish():
+            elapsed = time.time() - started
+            self.bus.recordPipeline(self.name, elapsed)
+            logging.debug("Pipeline %s done in %.1f ms: %r" % (self.name, elapsed * 1000.0, self.timings))
+
+            if callback is not None:
+                callback()
+
+        def _done(i):
+            def _callback(*args):
+                self.timings[self.ops[i]] = time.time() - started
+
+                pending.discard(i)
+                if not pending:
+                    _finish()
+            return _callback
+
+        if not self.ops:
+            _finish()
+            return
+
+        for i, (kind, queue, dest) in enumerate(self.ops):
+            if kind == "bind":
+                self.bus.bindQueue(queue, dest, _done(i))
+            elif kind == "unbind":
+                self.bus.unbindQueue(queue, dest, _done(i))
+            else:
+                self.bus.deleteQueue(queue, _done(i))
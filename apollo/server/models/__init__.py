@@ -74,17 +74,24 @@ class PrimaryKeyed(object):
         return Column("id", UUIDType, primary_key=True, default=uuid.uuid4, nullable=False)
 
 class MessagableMixin(object):
+    @classmethod
+    def routingKey(cls, prefix, ident):
+        return "%s.%s.%s" % (prefix, cls.__name__, ident)
+
+    def exRoutingKey(self):
+        return self.routingKey("ex", self.id)
+
     def sendEx(self, bus, packet):
-        bus.send("ex.%s.%s" % (self.__class__.__name__, self.id), packet)
+        bus.send(self.exRoutingKey(), packet)
 
     def sendInter(self, bus, packet):
-        bus.send("inter.%s.%s" % (self.__class__.__name__, self.id), packet)
+        bus.send(self.routingKey("inter", self.id), packet)
 
     def queueBind(self, bus, session, callback=None):
-        bus.bindQueue("ex:%s" % session.id, "ex.%s.%s" % (self.__class__.__name__, self.id), callback)
+        bus.bindQueue("ex:%s" % session.id, self.exRoutingKey(), callback)
 
     def queueUnbind(self, bus, session, callback=None):
-        bus.unbindQueue("ex:%s" % session.id, "ex.%s.%s" % (self.__class__.__name__, self.id), callback)
+        bus.unbindQueue("ex:%s" % session.id, self.exRoutingKey(), callback)
 
 class CaseInsensitiveComparator(ColumnProperty.Comparator):
     def __eq__(self, other):
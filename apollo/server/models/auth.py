@@ -25,7 +25,7 @@ import uuid
 from hashlib import sha256
 from datetime import datetime
 
-from sqlalchemy.orm import column_property, relationship, aliased, backref
+from sqlalchemy.orm import column_property, relationship, backref
 from sqlalchemy.schema import ForeignKey, Column, Index, Table
 from sqlalchemy.types import Integer, Unicode, Boolean, DateTime
 
@@ -40,6 +40,28 @@ group_security_domains = Table("group_security_domains", meta.Base.metadata,
 DIRECTLY_IN_DOMAIN = 1
 INDIRECTLY_IN_DOMAIN = 2
 
+def permissionLevel(paths, path):
+    """
+    Check if a set of security domains grants a domain, either directly or
+    through one of its ancestors.
+
+    :Parameters:
+         * ``paths``
+           Paths of the domains held.
+
+         * ``path``
+           Path of the domain to check.
+    """
+    if path in paths:
+        return DIRECTLY_IN_DOMAIN
+
+    parts = path.split(".")
+    for i in xrange(len(parts) - 1, 0, -1):
+        if ".".join(parts[:i]) in paths:
+            return INDIRECTLY_IN_DOMAIN
+
+    return False
+
 class Group(meta.Base, PrimaryKeyed, MessagableMixin):
     """
     A permission group.
@@ -62,20 +84,21 @@ class Group(meta.Base, PrimaryKeyed, MessagableMixin):
     """
 
     def inDomain(self, domain):
-        if domain in self.security_domains:
-            return DIRECTLY_IN_DOMAIN
-
-        # TODO: horrible, terrible! fix this with a PROPER query!
-        target_path = domain.getPath() + "."
+        return permissionLevel(set(held.path for held in self.security_domains), domain.path)
 
-        domain_paths = []
-        for domain in self.security_domains:
-            domain_paths.append(domain.getPath() + ".")
-
-        if any(target_path.startswith(path) for path in domain_paths):
-            return INDIRECTLY_IN_DOMAIN
+    @classmethod
+    def compilePermissions(cls, group_id):
+        """
+        Get the paths of every security domain a group holds directly, in one
+        query.
 
-        return False
+        :Parameters:
+             * ``group_id``
+               ID of the group.
+        """
+        return frozenset(path for path, in meta.Session().query(SecurityDomain.path) \
+            .filter(SecurityDomain.id == group_security_domains.c.security_domain_id) \
+            .filter(group_security_domains.c.group_id == group_id))
 
 Index("idx_group_name", Group.name, unique=True)
 
@@ -105,6 +128,22 @@ class SecurityDomain(meta.Base, PrimaryKeyed):
     The parent of the security domain.
     """
 
+    path = Column("path", Unicode(1024), nullable=False)
+    """
+    Materialized path of the security domain, e.g. ``apollo.server.admin``.
+    Set from the parent's path when the domain is created.
+    """
+
+    def __init__(self, **kwargs):
+        super(SecurityDomain, self).__init__(**kwargs)
+
+        if self.path is None:
+            parent = self.parent
+            if parent is None and self.parent_id is not None:
+                parent = meta.Session().query(SecurityDomain).get(self.parent_id)
+
+            self.path = parent is not None and u"%s.%s" % (parent.path, self.name) or self.name
+
     @classmethod
     def byPath(cls, path):
         """
@@ -114,25 +153,41 @@ class SecurityDomain(meta.Base, PrimaryKeyed):
           * ``path``
             Path to use, e.g. ``apollo.admin.clobber``.
         """
-        query = meta.Session().query(cls)
+        return meta.Session().query(cls).filter(cls.path == path).one()
 
-        path_parts = path.split(".")
-        query = query.filter(cls.name == path_parts[-1])
+    @classmethod
+    def rebuildPaths(cls):
+        """
+        Recompute the materialized path of every security domain from the
+        parent links, e.g. after adding the ``path`` column to an existing
+        database. Returns the number of domains updated.
+        """
+        sess = meta.Session()
+
+        domains = dict((domain_id, (name, parent_id, path)) for domain_id, name, parent_id, path in \
+            sess.query(cls.id, cls.name, cls.parent_id, cls.path))
+        paths = {}
 
-        for part in path_parts[:-1:-1]:
-            part_alias = aliased(cls)
-            query = query.join((part_alias, cls.parent)).filter(part_alias.name == part)
+        def _path(domain_id):
+            if domain_id not in paths:
+                name, parent_id, old_path = domains[domain_id]
+                paths[domain_id] = parent_id is not None and u"%s.%s" % (_path(parent_id), name) or name
+            return paths[domain_id]
 
-        return query.one()
+        updated = 0
+
+        for domain_id, (name, parent_id, old_path) in domains.iteritems():
+            if _path(domain_id) != old_path:
+                sess.query(cls).filter(cls.id == domain_id).update({ "path" : paths[domain_id] }, synchronize_session=False)
+                updated += 1
+
+        sess.commit()
+        return updated
 
     def getPath(self):
-        # TODO: somewhat horrible, fix this with a better query
-        current_domain = self
-        path = [self.name]
-        while current_domain.parent is not None:
-            current_domain = current_domain.parent
-            path.append(current_domain.name)
-        return ".".join(path[::-1])
+        return self.path
+
+Index("idx_security_domain_path", SecurityDomain.path, unique=True)
 
 class User(meta.Base, PrimaryKeyed, MessagableMixin, RPGUserMixin):
     """
@@ -117,8 +117,7 @@ class Chunk(meta.Base, PrimaryKeyed):
 
     tiles = relationship("Tile", backref="chunk")
 
-Index("idx_cx", Chunk.cx)
-Index("idx_cy", Chunk.cy)
+Index("idx_chunk_coords", Chunk.realm_id, Chunk.cx, Chunk.cy, unique=True)
 
 class Tile(meta.Base, PrimaryKeyed, MessagableMixin):
     """
@@ -153,8 +152,7 @@ class Tile(meta.Base, PrimaryKeyed, MessagableMixin):
     users = relationship("User", backref="location")
     professions_spawn = relationship("Profession", backref="spawnpoint")
 
-Index("idx_rx", Tile.rx)
-Index("idx_ry", Tile.ry)
+Index("idx_tile_coords", Tile.chunk_id, Tile.rx, Tile.ry, unique=True)
 
 class ConstructType(meta.Base, PrimaryKeyed):
     """
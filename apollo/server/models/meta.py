@@ -20,12 +20,66 @@
 # THE SOFTWARE.
 #
 
+import threading
+
+from contextlib import contextmanager
+
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 Session = scoped_session(sessionmaker())
 Base = declarative_base()
 
+# callbacks waiting for the current unit of work to commit, per thread (like
+# the session itself)
+_work = threading.local()
+
+@contextmanager
+def unitOfWork():
+    """
+    Run a block as a single database unit of work. Inside it, ``commit`` only
+    flushes, and the session is committed once when the block finishes, or
+    rolled back if it raises. Nested units of work join the outermost one.
+    """
+    if getattr(_work, "callbacks", None) is not None:
+        yield
+        return
+
+    _work.callbacks = []
+
+    try:
+        yield
+        Session.commit()
+    except:
+        Session.rollback()
+        _work.callbacks = None
+        raise
+
+    callbacks, _work.callbacks = _work.callbacks, None
+
+    for callback in callbacks:
+        callback()
+
+def commit(callback=None):
+    """
+    Commit the session, or only flush it if inside a ``unitOfWork``.
+
+    :Parameters:
+         * ``callback``
+           Function to call once the changes are committed, e.g. to announce
+           them.
+    """
+    callbacks = getattr(_work, "callbacks", None)
+
+    if callbacks is None:
+        Session.commit()
+        if callback is not None:
+            callback()
+    else:
+        Session.flush()
+        if callback is not None:
+            callbacks.append(callback)
+
 def bindSession(engine):
     """
     Bind the session to a database connection.
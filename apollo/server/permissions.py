@@ -0,0 +1,121 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Node-local cache of compiled group permissions.
+"""
+
+import logging
+
+from tornado.options import options
+
+from apollo.server.component import Component
+
+from apollo.server.models.auth import Group, permissionLevel
+
+from apollo.server.messaging.bus import publishBlocking
+
+from apollo.server.util.cache import TTLCache
+
+def announceChange():
+    """
+    Tell every node that security domains or grants have changed, from outside
+    the server (e.g. ``tools/asdat.py``). Returns ``False`` if the broker
+    couldn't be reached, in which case nodes only pick the change up once
+    their compiled permissions expire.
+    """
+    return publishBlocking("permissions.changed")
+
+class PermissionCache(Component):
+    """
+    Compiles the security domains each group holds into a set of paths, so
+    authorizing a user is a lookup of the requested path and its ancestors
+    rather than a walk of the domain tree.
+
+    Compiled permissions are dropped whenever a change is announced over
+    ``permissions.*``, and expire after ``permission_cache_ttl`` seconds in
+    case an announcement is missed.
+    """
+    def __init__(self, core):
+        super(PermissionCache, self).__init__(core)
+        self.cache = TTLCache(options.permission_cache_ttl, name="permissions")
+
+    def go(self):
+        """
+        Start listening for permission changes.
+        """
+        self.core.bus.onReady(self.on_bus_ready)
+
+        # changes may have been missed while the bus was down
+        self.core.bus.onReconnect(self.invalidate)
+
+    def on_bus_ready(self):
+        queue = "permissions:%s" % self.core.bus.busName
+        self.core.bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_change, no_ack=True)
+        bus.bindQueue(queue, "permissions.#")
+
+    def on_change(self, channel, method, header, body):
+        """
+        Drop compiled permissions after a change.
+        """
+        logging.info("Permissions changed, recompiling.")
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop every group's compiled permissions.
+        """
+        self.cache.clear()
+
+    def permissionsOf(self, group_id):
+        """
+        Get the compiled permissions of a group, i.e. the paths of the domains
+        it holds directly.
+
+        :Parameters:
+             * ``group_id``
+               ID of the group.
+        """
+        paths = self.cache.get(group_id)
+        if paths is None:
+            paths = Group.compilePermissions(group_id)
+            self.cache.set(group_id, paths)
+        return paths
+
+    def check(self, group_id, path):
+        """
+        Check if a group is in a security domain. Returns
+        ``DIRECTLY_IN_DOMAIN``, ``INDIRECTLY_IN_DOMAIN`` or ``False``.
+
+        :Parameters:
+             * ``group_id``
+               ID of the group.
+
+             * ``path``
+               Path of the domain, e.g. ``apollo.server.admin.clobber``.
+        """
+        return permissionLevel(self.permissionsOf(group_id), path)
@@ -83,6 +83,9 @@ class PluginRegistry(Component):
         if hasattr(plugin, "setup"):
             plugin.setup(self.core)
 
+        self.core.dylib_dispatcher.compile()
+        self.core.frontend.build()
+
     def isPluginLoaded(self, plugin_name):
         return plugin_name in self.plugins
 
@@ -93,3 +96,6 @@ class PluginRegistry(Component):
             plugin.shutdown(self.core)
 
         del self.plugins[plugin_name]
+
+        self.core.dylib_dispatcher.compile()
+        self.core.frontend.build()
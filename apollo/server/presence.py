@@ -0,0 +1,113 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Node-local tracking of session activity.
+"""
+
+import logging
+
+from datetime import datetime
+
+from sqlalchemy.sql.expression import bindparam
+from sqlalchemy.types import DateTime
+
+from tornado.ioloop import PeriodicCallback
+from tornado.options import options
+
+from apollo.server.component import Component
+
+from apollo.server.models import meta
+from apollo.server.models.auth import Session
+
+class PresenceTracker(Component):
+    """
+    Keeps track of when sessions were last active on this node, and writes
+    that to the ``sessions`` table in bulk every ``presence_flush_interval``
+    seconds instead of once per heartbeat.
+    """
+    def __init__(self, core):
+        super(PresenceTracker, self).__init__(core)
+        self.pending = {}
+
+    def touch(self, session_id):
+        """
+        Mark a session as active right now.
+
+        :Parameters:
+             * ``session_id``
+               ID of the session.
+        """
+        self.pending[session_id] = datetime.utcnow()
+
+    def lastActive(self, session_id):
+        """
+        Get the last time a session was active on this node that has not been
+        written to the database yet, or ``None``.
+
+        :Parameters:
+             * ``session_id``
+               ID of the session.
+        """
+        return self.pending.get(session_id)
+
+    def forget(self, session_id):
+        """
+        Stop tracking a session.
+
+        :Parameters:
+             * ``session_id``
+               ID of the session.
+        """
+        self.pending.pop(session_id, None)
+
+    def flush(self):
+        """
+        Write pending activity to the database, ``presence_flush_batch``
+        sessions per ``UPDATE``.
+        """
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+
+        sess = meta.Session()
+        table = Session.__table__
+
+        statement = table.update().where(table.c.id == bindparam("b_id")).values(
+            last_active=bindparam("b_last_active", type_=DateTime)
+        )
+
+        rows = [ { "b_id" : session_id, "b_last_active" : last_active } for session_id, last_active in pending.iteritems() ]
+
+        for i in xrange(0, len(rows), options.presence_flush_batch):
+            sess.execute(statement, rows[i:i + options.presence_flush_batch])
+        sess.commit()
+
+        logging.debug("Flushed activity of %d session(s)." % len(rows))
+
+    def go(self):
+        """
+        Start the flush cycle.
+        """
+        self.callback = PeriodicCallback(self.flush, options.presence_flush_interval * 1000)
+        self.callback.start()
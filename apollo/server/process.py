@@ -0,0 +1,96 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Pre-fork process supervision.
+"""
+
+import os
+import sys
+import errno
+import signal
+import logging
+
+def forkWorkers(num, target):
+    """
+    Fork worker processes and supervise them until they have all exited.
+    Workers that die abnormally are restarted. ``SIGTERM`` and ``SIGINT``
+    received by the supervisor are forwarded to the workers as ``SIGTERM`` so
+    they can shut down cleanly.
+
+    This only returns in the supervisor process, once every worker is gone.
+
+    :Parameters:
+         * ``num``
+           Number of workers to run.
+
+         * ``target``
+           Function run in each worker, called with the worker's task ID
+           (from ``0`` to ``num - 1``).
+    """
+    children = {}
+    stopping = [ False ]
+
+    def spawn(task_id):
+        pid = os.fork()
+
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+            try:
+                target(task_id)
+            except Exception:
+                logging.exception("Worker %d died with an exception." % task_id)
+                os._exit(1)
+            sys.exit(0)
+
+        children[pid] = task_id
+        logging.info("Started worker %d (pid %d)." % (task_id, pid))
+
+    def forward(signum, frame):
+        stopping[0] = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    for task_id in xrange(num):
+        spawn(task_id)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+
+        task_id = children.pop(pid)
+
+        if stopping[0] or not (os.WIFSIGNALED(status) or os.WEXITSTATUS(status)):
+            logging.info("Worker %d (pid %d) exited." % (task_id, pid))
+            continue
+
+        logging.warn("Worker %d (pid %d) died unexpectedly, restarting." % (task_id, pid))
+        spawn(task_id)
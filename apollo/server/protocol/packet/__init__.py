@@ -25,10 +25,32 @@ import json
 ORIGIN_EX = 1
 ORIGIN_INTER = 2
 
+DELIVERY_TRANSIENT = 1
+"""
+The packet may be lost if the broker restarts.
+"""
+
+DELIVERY_PERSISTENT = 2
+"""
+The packet is written to disk by the broker and survives a restart.
+"""
+
+DELIVERY_LATEST = 3
+"""
+The packet is transient, and only the most recent packet of its type waiting
+for a session is worth delivering.
+"""
+
 class Packet(object):
     """
     Base packet class. Implements the command pattern.
     """
+    delivery = DELIVERY_PERSISTENT
+    """
+    Delivery class of the packet, one of ``DELIVERY_TRANSIENT``,
+    ``DELIVERY_PERSISTENT`` or ``DELIVERY_LATEST``.
+    """
+
     def __init__(self, **payload):
         self.__dict__.update(payload)
 
@@ -48,12 +70,28 @@ class Packet(object):
 
     def dump(self):
         """
-        Dump the packet into JSON format.
+        Dump the packet into JSON format. Private (underscore-prefixed)
+        members are not dumped.
         """
-        dic = self.__dict__.copy()
+        dic = dict((key, value) for key, value in self.__dict__.iteritems() if key[0] != "_")
         dic["_name"] = self.__class__.name
         return json.dumps(dic)
 
+    def freeze(self):
+        """
+        Get the wire encoding of the packet, dumping it only the first time.
+        The encoding is kept until a data member of the packet changes, so a
+        packet sent to several destinations is only serialized once.
+        """
+        if "_wire" not in self.__dict__:
+            self._wire = self.dump()
+        return self._wire
+
+    def __setattr__(self, attr, value):
+        if attr[0] != "_":
+            self.__dict__.pop("_wire", None)
+        object.__setattr__(self, attr, value)
+
     def __getattr__(self, attr):
         return None
 
@@ -47,16 +47,59 @@ def autodiscover():
 
 autodiscover()
 
-def deserializePacket(payload):
+def loadPacket(raw_depayload):
     """
-    Deserialize a packet into the appropriate packet object.
+    Load a packet object from an already decoded payload.
 
     :Parameters:
-         * ``payload``
-           Packet payload that was transferred.
+         * ``raw_depayload``
+           Decoded packet payload, as a dictionary.
     """
-    raw_depayload = json.loads(payload)
     name = raw_depayload.get("_name")
     depayload = dict((key, value) for key, value in raw_depayload.iteritems() if key[0] != "_")
     if name in packetlist:
         return packetlist[name](**depayload)
+
+def deserializePacket(payload):
+    """
+    Deserialize a packet into the appropriate packet object. The packet keeps
+    the payload as its wire encoding, so relaying it unchanged doesn't dump
+    it again.
+
+    :Parameters:
+         * ``payload``
+           Packet payload that was transferred.
+    """
+    packet = loadPacket(json.loads(payload))
+    if packet is not None:
+        packet._wire = payload
+    return packet
+
+def deserializePackets(payload):
+    """
+    Deserialize a payload containing either a single packet or an array of
+    packets into a list of packet objects.
+
+    Raises ``ValueError`` if any packet in the payload is malformed or of an
+    unknown type.
+
+    :Parameters:
+         * ``payload``
+           Packet payload that was transferred.
+    """
+    raw_depayload = json.loads(payload)
+
+    if not isinstance(raw_depayload, list):
+        raw_depayload = [ raw_depayload ]
+
+    packets = []
+    for raw_packet in raw_depayload:
+        if not isinstance(raw_packet, dict):
+            raise ValueError("packet is not an object")
+
+        packet = loadPacket(raw_packet)
+        if packet is None:
+            raise ValueError("unknown packet type: %s" % raw_packet.get("_name"))
+        packets.append(packet)
+
+    return packets
@@ -24,7 +24,7 @@ from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from apollo.server.models import meta
 from apollo.server.models.auth import User
 
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 
 from apollo.server.util.auth import requireAuthentication
@@ -44,6 +44,7 @@ class PacketChat(Packet):
            Message body.
     """
     name = "chat"
+    delivery = DELIVERY_TRANSIENT
 
     @requireAuthentication
     def dispatch(self, core, session):
@@ -62,19 +63,15 @@ class PacketChat(Packet):
                 target.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="User is not online."))
                 return
 
-            # send packet to target
-            target.sendEx(core.bus, PacketChat(
+            packet = PacketChat(
                 origin=user.name,
                 target=self.target,
                 msg=self.msg
-            ))
+            )
 
-            # send packet to origin
-            user.sendEx(core.bus, PacketChat(
-                origin=user.name,
-                target=self.target,
-                msg=self.msg
-            ))
+            # send packet to target and origin
+            target.sendEx(core.bus, packet)
+            user.sendEx(core.bus, packet)
             return
 
         core.bus.broadcastEx(PacketChat(
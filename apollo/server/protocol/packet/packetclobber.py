@@ -20,13 +20,9 @@
 # THE SOFTWARE.
 #
 
-from sqlalchemy.sql.expression import and_
-from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
+from apollo.server.models.geography import Realm
 
-from apollo.server.models import meta
-from apollo.server.models.geography import Chunk, Tile, Realm
-
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 
 from apollo.server.util.auth import requireAuthentication, requireAuthorization
@@ -40,18 +36,13 @@ class PacketClobber(Packet):
         Bidirectional.
     """
     name = "clobber"
+    delivery = DELIVERY_TRANSIENT
 
-    def _render_callback(self, core, chunk):
-        sess = meta.Session()
-
-        chunk.fresh = True
-
-        sess.merge(chunk)
-        sess.commit()
-
-        chunk.realm.sendEx(core.bus, PacketClobber(
-            cx=chunk.cx,
-            cy=chunk.cy
+    def _render_callback(self, core, realm_id, cx, cy):
+        # the renderer has already marked the chunk fresh
+        core.bus.send(Realm.routingKey("ex", realm_id), PacketClobber(
+            cx=cx,
+            cy=cy
         ))
 
     @requireAuthorization("apollo.server.admin.clobber")
@@ -59,10 +50,18 @@ class PacketClobber(Packet):
     def dispatch(self, core, session):
         user = session.user
 
-        try:
-            chunk = meta.Session().query(Chunk).filter(Chunk.id == Tile.chunk_id).filter(Tile.id == user.location_id).one()
-        except (NoResultFound, MultipleResultsFound):
+        located = core.grids.locate(user.location_id)
+        chunk_id = located is not None and located[0].chunkAt(*located[1]) or None
+
+        if chunk_id is None:
             user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Could not find chunk to clobber."))
             return
 
-        core.rendervisor.renderChunk(chunk.id, callback=lambda *args: self._render_callback(core, chunk))
+        grid = located[0]
+        cx, cy = grid.chunkCoordsOf(chunk_id)
+
+        # clobbering is how a chunk whose tiles were changed gets picked up, so
+        # every node needs to reload the realm, and so does the renderer
+        core.grids.changed(grid.realm_id)
+
+        core.rendervisor.renderChunk(chunk_id, callback=lambda *args: self._render_callback(core, grid.realm_id, cx, cy))
@@ -20,7 +20,7 @@
 # THE SOFTWARE.
 #
 
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 
 SEVERITY_WARN = 0
 SEVERITY_ERROR = 1
@@ -42,4 +42,5 @@ class PacketError(Packet):
     """
 
     name = "error"
+    delivery = DELIVERY_TRANSIENT
 
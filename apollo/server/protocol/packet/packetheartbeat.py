@@ -20,10 +20,7 @@
 # THE SOFTWARE.
 #
 
-from datetime import datetime
-
-from apollo.server.models import meta
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 
 class PacketHeartbeat(Packet):
     """
@@ -37,10 +34,8 @@ class PacketHeartbeat(Packet):
     """
 
     name = "heartbeat"
+    delivery = DELIVERY_TRANSIENT
 
     def dispatch(self, core, session):
-        sess = meta.Session()
-        session.last_active = datetime.utcnow()
-        sess.merge(session)
-        sess.commit()
+        core.presence.touch(session.id)
 
@@ -19,16 +19,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
-from sqlalchemy.sql.expression import and_
-
-from apollo.server.protocol.packet import Packet
-
-from apollo.server.models import meta
-from apollo.server.models.geography import Tile, Chunk, CHUNK_STRIDE, Terrain, Realm
-from apollo.server.models.auth import User
+from apollo.server.protocol.packet import Packet, DELIVERY_LATEST
+from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 
 from apollo.server.util.auth import requireAuthentication
-from apollo.server.util.mathhelper import dissolve
 
 class PacketInfo(Packet):
     """
@@ -53,43 +47,40 @@ class PacketInfo(Packet):
     """
 
     name = "info"
+    delivery = DELIVERY_LATEST
 
     @requireAuthentication
     def dispatch(self, core, session):
         user = session.user
-        sess = meta.Session()
+        context = core.grids.context(user.location_id, exclude_user_id=user.id)
 
-        # TODO: optimize these queries (more joins!)
-        tile = sess.query(Tile).get(user.location_id)
-        terrain = tile.terrain
-        chunk = tile.chunk
-        realm = chunk.realm
+        if context is None:
+            user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Could not find current tile."))
+            return
 
         # get the players here
         things = []
 
-        for target in sess.query(User).filter(and_(User.location_id == tile.id, User.online == True, User.id != user.id)):
+        for target_id, name, level in context.occupants:
             things.append({
-                "name"  : target.name,
-                "level" : target.level,
+                "name"  : name,
+                "level" : level,
                 "type"  : "user"
             })
 
-        acoords = dissolve(chunk.cx, chunk.cy, tile.rx, tile.ry, CHUNK_STRIDE)
-
         user.sendEx(core.bus, PacketInfo(
             location={
-                "x"     : acoords[0],
-                "y"     : acoords[1],
-                "realm" : realm.name,
+                "x"     : context.x,
+                "y"     : context.y,
+                "realm" : context.grid.name,
             },
             terrain={
-                "img"   : terrain.img,
-                "name"  : terrain.name,
+                "img"   : context.terrain.img,
+                "name"  : context.terrain.name,
             },
             size={
-                "cw"    : realm.cw,
-                "ch"    : realm.ch
+                "cw"    : context.grid.cw,
+                "ch"    : context.grid.ch
             },
             things=things
         ))
@@ -32,6 +32,8 @@ from apollo.server.protocol.packet.packetuser import PacketUser
 
 from apollo.server.protocol.packet.packetlogout import PacketLogout
 
+from apollo.server.messaging.pipeline import BindPipeline
+
 class PacketLogin(Packet):
     """
     Log into the server, or inform the client a user has logged in.
@@ -57,16 +59,23 @@ class PacketLogin(Packet):
 
         user = session.user
 
+        user.online = True
+
+        sess.merge(user)
+        meta.commit()
+
         core.bus.broadcastEx(PacketLogin(username=user.name))
 
-        # send this everywhere
-        user.location.sendInter(core.bus, PacketInfo())
-        user.location.sendInter(core.bus, PacketUser())
+        # the user has to be routable before anything is sent to the tile
+        core.routing.online(user.id, user.location_id, user.group_id, user.location.chunk.realm_id)
 
-        user.online = True
+        # the node that gets the tile's inter traffic may not have heard the
+        # user is online yet, so their own packets can't go that way
+        PacketInfo().dispatch(core, session)
+        PacketUser().dispatch(core, session)
 
-        sess.merge(user)
-        sess.commit()
+        # let everyone else on the tile know
+        user.location.sendInter(core.bus, PacketInfo())
 
     def dispatch(self, core, session):
         sess = meta.Session()
@@ -86,13 +95,16 @@ class PacketLogin(Packet):
             user.sendInter(core.bus, PacketLogout(msg="Session clash"))
             user.online = False
             sess.merge(user)
-            sess.commit()
+            meta.commit()
             return
 
         # set all the sessions and stuff
         session.user_id = user.id
         sess.merge(session)
-        sess.commit()
+
+        # drop any stale copy of the session, but let the next lookup cache it
+        # again
+        meta.commit(lambda: core.session_cache.invalidate(session.id, revoke=False))
 
         session.sendEx(core.bus, PacketLogin())
 
@@ -100,15 +112,13 @@ class PacketLogin(Packet):
         tile = user.location
         chunk = tile.chunk
 
-        # do some funkatronic queue binds and callbacking
-        core.bus.globalBind(session,
-            lambda *args: user.queueBind(core.bus, session,
-                lambda *args: tile.queueBind(core.bus, session,
-                    lambda *args: user.group.queueBind(core.bus, session,
-                        lambda *args: chunk.realm.queueBind(core.bus, session,
-                            self._dispatch_stage_2(core, session)
-                        )
-                    )
-                )
-            )
-        )
+        # bind everything at once and carry on once it's all bound
+        queue = "ex:%s" % session.id
+
+        BindPipeline(core.bus, "login") \
+            .bind(queue, "ex.global") \
+            .bind(queue, user.exRoutingKey()) \
+            .bind(queue, tile.exRoutingKey()) \
+            .bind(queue, user.group.exRoutingKey()) \
+            .bind(queue, chunk.realm.exRoutingKey()) \
+            .run(lambda: self._dispatch_stage_2(core, session))
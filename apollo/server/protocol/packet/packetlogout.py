@@ -30,6 +30,8 @@ from apollo.server.models import meta
 
 from apollo.server.protocol.packet.packetinfo import PacketInfo
 
+from apollo.server.messaging.pipeline import BindPipeline
+
 class PacketLogout(Packet):
     """
     Log out of the server, or inform the client a user has logged out.
@@ -64,15 +66,29 @@ class PacketLogout(Packet):
 
             # unset online
             user.online = False
+            core.routing.offline(user.id)
 
             # send packetinfo to relevant people
             tile = sess.query(Tile).get(user.location_id)
             tile.sendInter(core.bus, PacketInfo())
 
             # delete all sessions and queues associated
-            for session in user.sessions:
-                core.bus.deleteQueue("ex:%s" % session.id)
+            pipeline = BindPipeline(core.bus, "logout")
+
+            session_ids = [ session.id for session in user.sessions ]
+
+            for session_id in session_ids:
+                core.consumers.release(session_id)
+                core.presence.forget(session_id)
+                pipeline.delete("ex:%s" % session_id)
+
+            pipeline.run()
 
             sess.query(Session).filter(Session.user_id == user.id).delete()
 
-            sess.commit()
+            def _revoke():
+                for session_id in session_ids:
+                    core.session_cache.invalidate(session_id)
+
+            # only once they're gone, so no node can cache them again
+            meta.commit(_revoke)
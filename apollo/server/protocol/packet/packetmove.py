@@ -19,21 +19,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
-from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
-from sqlalchemy.sql.expression import and_
-
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 
 from apollo.server.models import meta
-from apollo.server.models.geography import Chunk, CHUNK_STRIDE, Tile
+from apollo.server.models.geography import Tile
 
 from apollo.server.util.auth import requireAuthentication
 
-from apollo.server.util.mathhelper import absolve
-
 from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 from apollo.server.protocol.packet.packetinfo import PacketInfo
 
+from apollo.server.messaging.pipeline import BindPipeline
+
 from apollo.framework import PredicateNotMatchedError
 
 class PacketMove(Packet):
@@ -53,43 +50,48 @@ class PacketMove(Packet):
     """
 
     name = "move"
+    delivery = DELIVERY_TRANSIENT
 
     @requireAuthentication
     def dispatch(self, core, session):
         user = session.user
         sess = meta.Session()
 
-        old_tile = sess.query(Tile).get(user.location_id)
-
-        # get the tile the user wants to move to
-        ccoords, rcoords = absolve(self.x, self.y, CHUNK_STRIDE)
+        old_tile_id = user.location_id
 
-        # find the chunk
-        try:
-            chunk = sess.query(Chunk).filter(and_(Chunk.cx == ccoords[0], Chunk.cy == ccoords[1])).one()
-        except (NoResultFound, MultipleResultsFound):
-            user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Cannot move there."))
-            return False
+        # moves stay within the user's realm
+        location = core.routing.locationOf(user.id)
+        if location is not None:
+            grid = core.grids.grid(location[2])
+        else:
+            located = core.grids.locate(old_tile_id)
+            grid = located is not None and located[0] or None
 
-        # find the tile
-        try:
-            tile = sess.query(Tile).filter(and_(Tile.rx == rcoords[0], Tile.ry == rcoords[1], Tile.chunk_id == chunk.id)).one()
-        except (NoResultFound, MultipleResultsFound):
+        # find the tile the user wants to move to
+        tile_id = grid is not None and grid.tileAt(self.x, self.y) or None
+        if tile_id is None:
             user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Cannot move there."))
             return False
 
-        user.location_id = tile.id
+        user.location_id = tile_id
 
         sess.merge(user)
-        sess.commit()
+        meta.commit()
+
+        core.routing.moved(user.id, tile_id, grid.realm_id)
 
         # rebind queue to new position
-        old_tile.queueUnbind(core.bus, session)
-        tile.queueBind(core.bus, session)
+        queue = "ex:%s" % session.id
+
+        def _rebound():
+            # some users may require additional info (including this one!)
+            core.bus.send(Tile.routingKey("inter", tile_id), PacketInfo())
+            core.bus.send(Tile.routingKey("inter", old_tile_id), PacketInfo())
 
-        # some users may require additional info (including this one!)
-        tile.sendInter(core.bus, PacketInfo())
-        old_tile.sendInter(core.bus, PacketInfo())
+        BindPipeline(core.bus, "move") \
+            .unbind(queue, Tile.routingKey("ex", old_tile_id)) \
+            .bind(queue, Tile.routingKey("ex", tile_id)) \
+            .run(_rebound)
 
         # return true for hooks
         return True
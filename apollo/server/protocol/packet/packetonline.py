@@ -20,7 +20,7 @@
 # THE SOFTWARE.
 #
 
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 
 from apollo.server.models import meta
 from apollo.server.models.auth import User
@@ -39,6 +39,7 @@ class PacketOnline(Packet):
     """
 
     name = "online"
+    delivery = DELIVERY_TRANSIENT
 
     @requireAuthentication
     def dispatch(self, core, session):
@@ -19,19 +19,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from apollo.server.models.auth import User
-from apollo.server.models.geography import Tile, Chunk, CHUNK_STRIDE, Realm
 
-from apollo.server.protocol.packet import Packet
+from apollo.server.protocol.packet import Packet, DELIVERY_TRANSIENT
 from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 
 from apollo.server.models import meta
 from apollo.server.models.rpg import Profession
 
 from apollo.server.util.auth import requireAuthentication
-from apollo.server.util.mathhelper import dissolve
 
 class PacketUser(Packet):
     """
@@ -66,6 +65,7 @@ class PacketUser(Packet):
     """
 
     name = "user"
+    delivery = DELIVERY_TRANSIENT
 
     @requireAuthentication
     def dispatch(self, core, session):
@@ -76,7 +76,7 @@ class PacketUser(Packet):
             target = user
         else:
             try:
-                target = sess.query(User).filter(User.name == self.target).one()
+                target = sess.query(User).options(joinedload("profession")).filter(User.name == self.target).one()
             except (NoResultFound, MultipleResultsFound):
                 user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="User not found."))
                 return
@@ -86,19 +86,20 @@ class PacketUser(Packet):
             user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="User not found."))
             return
 
-        tile = target.location
-        chunk = tile.chunk
+        context = core.grids.context(target.location_id, occupants=False)
 
-        acoords = dissolve(chunk.cx, chunk.cy, tile.rx, tile.ry, CHUNK_STRIDE)
+        if context is None:
+            user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Could not find user's location."))
+            return
 
         packet = PacketUser(
             name=target.name,
             level=target.level,
             profession=target.profession.name,
             location={
-                "x"     : acoords[0],
-                "y"     : acoords[1],
-                "realm" : chunk.realm.name
+                "x"     : context.x,
+                "y"     : context.y,
+                "realm" : context.grid.name
             },
             hp={ "now" : target.hp, "max" : target.hpmax },
             ap={ "now" : target.ap, "max" : target.apmax },
@@ -0,0 +1,415 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+In-memory read model of the static geography of realms.
+"""
+
+import uuid
+import array
+import logging
+
+from collections import namedtuple
+
+from apollo.server.component import Component
+
+from apollo.server.models import meta
+from apollo.server.models.auth import User
+from apollo.server.models.geography import Terrain, Realm, Chunk, Tile, CHUNK_STRIDE
+
+from apollo.server.protocol.packet import DELIVERY_TRANSIENT
+
+from apollo.server.messaging.bus import publishBlocking
+
+from apollo.server.util.mathhelper import absolve, dissolve
+
+NO_TERRAIN = 0xffff
+"""
+Terrain index of a cell with no tile.
+"""
+
+NIL_ID = "\0" * 16
+
+TerrainInfo = namedtuple("TerrainInfo", "id name img")
+"""
+A terrain type, as held by the read model.
+"""
+
+TileContext = namedtuple("TileContext", "tile_id terrain chunk_id grid x y occupants")
+"""
+Everything about a tile needed to describe it to a client: its terrain, chunk,
+realm (as its ``RealmGrid``), absolute coordinates and the users online there
+(as tuples of ID, name and level).
+"""
+
+def announceChange(realm_id=None):
+    """
+    Tell every node that the geography of a realm (or the terrain types) has
+    changed, from outside the server (e.g. a tool that generates or edits a
+    realm). Returns ``False`` if the broker couldn't be reached.
+
+    :Parameters:
+         * ``realm_id``
+           ID of the realm (every realm if ``None``).
+    """
+    return publishBlocking("geography.%s.tool" % (realm_id is not None and realm_id.hex or "all"))
+
+class RealmGrid(object):
+    """
+    A realm held as flat arrays, indexed by absolute coordinates: the terrain
+    (as an index into the terrain table) and tile ID of every cell, and the ID
+    of every chunk.
+
+    Coordinates outside the realm (as given by its ``cw`` and ``ch``) have
+    nothing in them.
+    """
+
+    def __init__(self, realm_id, name, cw, ch, terrains):
+        self.realm_id = realm_id
+        self.name = name
+        self.cw = cw
+        self.ch = ch
+
+        self.width = cw * CHUNK_STRIDE
+        self.height = ch * CHUNK_STRIDE
+
+        self.terrains = terrains
+
+        self.terrain = array.array("H", [ NO_TERRAIN ]) * (self.width * self.height)
+        self.tile_ids = bytearray(16 * self.width * self.height)
+        self.chunk_ids = bytearray(16 * cw * ch)
+
+        # reverse lookups
+        self.tile_cells = {}
+        self.chunk_coords = {}
+
+    def _cell(self, ax, ay):
+        if 0 <= ax < self.width and 0 <= ay < self.height:
+            return ay * self.width + ax
+        return None
+
+    def _chunkCell(self, cx, cy):
+        if 0 <= cx < self.cw and 0 <= cy < self.ch:
+            return cy * self.cw + cx
+        return None
+
+    def setChunk(self, chunk_id, cx, cy):
+        cell = self._chunkCell(cx, cy)
+        if cell is None:
+            logging.warn("Chunk %s at (%d, %d) is outside realm %s." % (chunk_id, cx, cy, self.realm_id))
+            return
+
+        self.chunk_ids[cell * 16:cell * 16 + 16] = chunk_id.bytes
+        self.chunk_coords[chunk_id] = (cx, cy)
+
+    def setTile(self, tile_id, ax, ay, terrain):
+        cell = self._cell(ax, ay)
+        if cell is None:
+            logging.warn("Tile %s at (%d, %d) is outside realm %s." % (tile_id, ax, ay, self.realm_id))
+            return
+
+        self.terrain[cell] = terrain
+        self.tile_ids[cell * 16:cell * 16 + 16] = tile_id.bytes
+        self.tile_cells[tile_id] = cell
+
+    def tileAt(self, ax, ay):
+        """
+        Get the ID of the tile at some absolute coordinates, or ``None``.
+        """
+        cell = self._cell(ax, ay)
+        if cell is None or self.terrain[cell] == NO_TERRAIN:
+            return None
+        return uuid.UUID(bytes=str(self.tile_ids[cell * 16:cell * 16 + 16]))
+
+    def terrainAt(self, ax, ay):
+        """
+        Get the ``TerrainInfo`` of the tile at some absolute coordinates, or
+        ``None``.
+        """
+        cell = self._cell(ax, ay)
+        if cell is None or self.terrain[cell] == NO_TERRAIN:
+            return None
+        return self.terrains[self.terrain[cell]]
+
+    def chunkAt(self, ax, ay):
+        """
+        Get the ID of the chunk containing some absolute coordinates, or
+        ``None``.
+        """
+        (cx, cy), rcoords = absolve(ax, ay, CHUNK_STRIDE)
+
+        cell = self._chunkCell(cx, cy)
+        if cell is None:
+            return None
+
+        chunk_id = str(self.chunk_ids[cell * 16:cell * 16 + 16])
+        if chunk_id == NIL_ID:
+            return None
+        return uuid.UUID(bytes=chunk_id)
+
+    def coordsOf(self, tile_id):
+        """
+        Get the absolute coordinates of a tile, or ``None`` if it isn't in the
+        realm.
+        """
+        cell = self.tile_cells.get(tile_id)
+        if cell is None:
+            return None
+        return cell % self.width, cell // self.width
+
+    def chunkCoordsOf(self, chunk_id):
+        """
+        Get the coordinates of a chunk, or ``None`` if it isn't in the realm.
+        """
+        return self.chunk_coords.get(chunk_id)
+
+    def chunks(self):
+        """
+        Get the IDs of every chunk in the realm.
+        """
+        return self.chunk_coords.keys()
+
+    def chunkTiles(self, chunk_id):
+        """
+        Get the tiles in a chunk, as a list of relative coordinates and
+        ``TerrainInfo``.
+        """
+        cx, cy = self.chunk_coords[chunk_id]
+        tiles = []
+
+        for rx in xrange(CHUNK_STRIDE):
+            for ry in xrange(CHUNK_STRIDE):
+                terrain = self.terrainAt(*dissolve(cx, cy, rx, ry, CHUNK_STRIDE))
+                if terrain is not None:
+                    tiles.append((rx, ry, terrain))
+
+        return tiles
+
+class RealmGridRegistry(Component):
+    """
+    Holds the ``RealmGrid`` of every realm this process has needed, loaded on
+    first use. Anything that changes the geography of a realm at runtime must
+    call ``changed``, which refreshes the realm here and tells every other
+    node to do the same.
+    """
+
+    def __init__(self, core):
+        super(RealmGridRegistry, self).__init__(core)
+
+        self.grids = {}
+
+    def go(self):
+        """
+        Start listening for geography changes from other nodes.
+        """
+        self.core.bus.onReady(self.on_bus_ready)
+
+        # changes may have been missed while the bus was down
+        self.core.bus.onReconnect(self.refresh)
+
+    def on_bus_ready(self):
+        queue = "geography:%s" % self.core.bus.busName
+        self.core.bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_change, no_ack=True)
+        bus.bindQueue(queue, "geography.#")
+
+    def on_change(self, channel, method, header, body):
+        """
+        Refresh a realm changed by another node.
+        """
+        prefixparts = method.routing_key.split(".")
+
+        if prefixparts[2] == self.core.bus.busName:
+            return
+
+        self.refresh(prefixparts[1] != "all" and uuid.UUID(hex=prefixparts[1]) or None)
+
+    def loadTerrains(self):
+        """
+        Load the terrain table, as a list of ``TerrainInfo`` and a mapping of
+        terrain IDs to their index in it.
+        """
+        terrains = []
+        terrain_index = {}
+
+        for terrain_id, name, img in meta.Session().query(Terrain.id, Terrain.name, Terrain.img):
+            terrain_index[terrain_id] = len(terrains)
+            terrains.append(TerrainInfo(terrain_id, name, img))
+
+        return terrains, terrain_index
+
+    def load(self, realm_id):
+        """
+        Load the grid of a realm from the database. The terrain table is
+        loaded along with it, so it is never older than the realm.
+
+        :Parameters:
+             * ``realm_id``
+               ID of the realm.
+        """
+        sess = meta.Session()
+
+        row = sess.query(Realm.name, Realm.cw, Realm.ch).filter(Realm.id == realm_id).first()
+        if row is None:
+            return None
+
+        terrains, terrain_index = self.loadTerrains()
+        grid = RealmGrid(realm_id, row[0], row[1], row[2], terrains)
+
+        for chunk_id, cx, cy in sess.query(Chunk.id, Chunk.cx, Chunk.cy).filter(Chunk.realm_id == realm_id):
+            grid.setChunk(chunk_id, cx, cy)
+
+        for tile_id, terrain_id, cx, cy, rx, ry in sess.query(Tile.id, Tile.terrain_id, Chunk.cx, Chunk.cy, Tile.rx, Tile.ry) \
+            .filter(Tile.chunk_id == Chunk.id) \
+            .filter(Chunk.realm_id == realm_id):
+            ax, ay = dissolve(cx, cy, rx, ry, CHUNK_STRIDE)
+            grid.setTile(tile_id, ax, ay, terrain_index[terrain_id])
+
+        self.grids[realm_id] = grid
+        logging.info("Realm grid for %s loaded with %d tile(s)." % (realm_id, len(grid.tile_cells)))
+
+        return grid
+
+    def grid(self, realm_id):
+        """
+        Get the grid of a realm, or ``None`` if there is no such realm.
+
+        :Parameters:
+             * ``realm_id``
+               ID of the realm.
+        """
+        if realm_id in self.grids:
+            return self.grids[realm_id]
+        return self.load(realm_id)
+
+    def locate(self, tile_id):
+        """
+        Find a tile. Returns the grid of its realm and its absolute
+        coordinates, as a tuple, or ``None`` if there is no such tile.
+
+        :Parameters:
+             * ``tile_id``
+               ID of the tile.
+        """
+        for grid in self.grids.itervalues():
+            coords = grid.coordsOf(tile_id)
+            if coords is not None:
+                return grid, coords
+
+        # it's in a realm we haven't needed yet
+        realm_id = meta.Session().query(Chunk.realm_id) \
+            .filter(Chunk.id == Tile.chunk_id) \
+            .filter(Tile.id == tile_id) \
+            .scalar()
+
+        grid = realm_id is not None and self.grid(realm_id) or None
+        if grid is None or grid.coordsOf(tile_id) is None:
+            return None
+        return grid, grid.coordsOf(tile_id)
+
+    def locateChunk(self, chunk_id):
+        """
+        Find a chunk. Returns the grid of its realm and its coordinates, as a
+        tuple, or ``None`` if there is no such chunk.
+
+        :Parameters:
+             * ``chunk_id``
+               ID of the chunk.
+        """
+        for grid in self.grids.itervalues():
+            coords = grid.chunkCoordsOf(chunk_id)
+            if coords is not None:
+                return grid, coords
+
+        realm_id = meta.Session().query(Chunk.realm_id).filter(Chunk.id == chunk_id).scalar()
+
+        grid = realm_id is not None and self.grid(realm_id) or None
+        if grid is None or grid.chunkCoordsOf(chunk_id) is None:
+            return None
+        return grid, grid.chunkCoordsOf(chunk_id)
+
+    def context(self, tile_id, exclude_user_id=None, occupants=True):
+        """
+        Load the ``TileContext`` of a tile, or ``None`` if there is no such
+        tile. The geography comes from the grid, so the only query is for the
+        occupants.
+
+        :Parameters:
+             * ``tile_id``
+               ID of the tile.
+
+             * ``exclude_user_id``
+               ID of a user to leave out of the occupants, e.g. the one asking.
+
+             * ``occupants``
+               Whether to load the occupants at all.
+        """
+        located = self.locate(tile_id)
+        if located is None:
+            return None
+
+        grid, (ax, ay) = located
+        users = []
+
+        if occupants:
+            query = meta.Session().query(User.id, User.name, User.level) \
+                .filter(User.location_id == tile_id) \
+                .filter(User.online == True)
+
+            if exclude_user_id is not None:
+                query = query.filter(User.id != exclude_user_id)
+
+            users = [ tuple(row) for row in query ]
+
+        return TileContext(tile_id, grid.terrainAt(ax, ay), grid.chunkAt(ax, ay), grid, ax, ay, users)
+
+    def refresh(self, realm_id=None):
+        """
+        Drop the grid of a realm, to be loaded again (with a fresh terrain
+        table) when next needed.
+
+        :Parameters:
+             * ``realm_id``
+               ID of the realm (all of them if ``None``).
+        """
+        if realm_id is None:
+            self.grids = {}
+        else:
+            self.grids.pop(realm_id, None)
+
+    def changed(self, realm_id=None):
+        """
+        Refresh a realm whose geography has changed, here and on every other
+        node. Terrain types are refreshed too.
+
+        :Parameters:
+             * ``realm_id``
+               ID of the realm (every realm if ``None``, e.g. after changing
+               a terrain type).
+        """
+        self.refresh(realm_id)
+
+        self.core.bus.publish("geography.%s.%s" % (realm_id is not None and realm_id.hex or "all", self.core.bus.busName), "", DELIVERY_TRANSIENT)
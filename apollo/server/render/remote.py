@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Rendering on behalf of worker processes that don't own the renderer pool.
+"""
+
+import json
+import uuid
+import logging
+
+from tornado.ioloop import IOLoop
+
+from apollo.server.component import Component
+from apollo.server.protocol.packet import DELIVERY_TRANSIENT
+from apollo.server.render.supervisor import RendererSupervisor
+
+class RenderServer(Component):
+    """
+    Serves render requests from other workers with the local renderer
+    supervisor.
+    """
+
+    def __init__(self, core, supervisor):
+        super(RenderServer, self).__init__(core)
+        self.supervisor = supervisor
+
+    def go(self):
+        """
+        Start serving render requests. The bus must be ready.
+        """
+        self.core.bus.declareQueue("render", self.on_queue_declared)
+
+    def on_queue_declared(self, *args):
+        self.core.bus.consume("render", self.on_request)
+        self.core.bus.bindQueue("render", "render")
+
+        logging.info("Serving render requests.")
+
+    def on_request(self, channel, method, header, body):
+        """
+        Handle a render request.
+        """
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        request = json.loads(body)
+
+        def _reply():
+            self.core.bus.publish("reply.%s" % request["reply_to"], json.dumps({
+                "request_id"    : request["request_id"]
+            }), DELIVERY_TRANSIENT)
+
+        # the pool calls back from its own thread
+        self.supervisor.renderChunk(
+            uuid.UUID(hex=request["chunk_id"]),
+            callback=lambda *args: IOLoop.instance().add_callback(_reply)
+        )
+
+class RemoteRendererSupervisor(RendererSupervisor):
+    """
+    Stands in for the renderer supervisor in workers that don't own the pool,
+    forwarding render requests to the worker that does.
+    """
+
+    def __init__(self, core):
+        super(RemoteRendererSupervisor, self).__init__(core.grids)
+
+        self.core = core
+        self.callbacks = {}
+
+    def go(self):
+        self.core.bus.onReady(self.on_bus_ready)
+
+    def on_bus_ready(self):
+        bus = self.core.bus
+        queue = "reply:%s" % bus.busName
+
+        bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_reply, no_ack=True)
+        bus.bindQueue(queue, "reply.%s" % bus.busName)
+
+    def stop(self, safe=True):
+        pass
+
+    def renderChunk(self, chunk_id, callback=None):
+        request_id = uuid.uuid4().hex
+
+        if callback is not None:
+            self.callbacks[request_id] = callback
+
+        self.core.bus.publish("render", json.dumps({
+            "chunk_id"      : chunk_id.hex,
+            "request_id"    : request_id,
+            "reply_to"      : self.core.bus.busName
+        }), DELIVERY_TRANSIENT)
+
+    def on_reply(self, channel, method, header, body):
+        """
+        Handle a render reply.
+        """
+        callback = self.callbacks.pop(json.loads(body)["request_id"], None)
+
+        if callback is not None:
+            callback(None)
@@ -25,6 +25,7 @@ Supervisor for the renderer processes.
 """
 
 import os
+import signal
 import logging
 
 import Image
@@ -53,13 +54,23 @@ STATIC_CHUNK_PATH = os.path.join(STATIC_PATH, "chunks")
 Path to the ``/static/chunks`` directory.
 """
 
-def render(chunk_id):
+def render(chunk_id, cx, cy, tiles):
     """
     Render a given chunk.
 
     :Parameters:
          * ``chunk_id``
            The ID of the chunk.
+
+         * ``cx``
+           x coordinate of the chunk.
+
+         * ``cy``
+           y coordinate of the chunk.
+
+         * ``tiles``
+           Tiles in the chunk, as a list of relative coordinates and terrain
+           image names.
     """
     try:
         sess = meta.Session()
@@ -78,15 +89,12 @@ def render(chunk_id):
             (0, 0, 0, 0)
         )
 
-        chunk = sess.query(Chunk).get(chunk_id)
+        for rx, ry, img in tiles:
+            tx, ty = isometricTransform(rx, ry)
 
-        for tile in sess.query(Tile).filter(Tile.chunk_id==chunk.id):
-            terrain = sess.query(Terrain).get(tile.terrain_id)
-            tx, ty = isometricTransform(tile.rx, tile.ry)
-
-            if terrain.img not in img_cache:
-                img_cache[terrain.img] = Image.open(os.path.join(STATIC_TILE_PATH, "%s.png" % terrain.img))
-            tile_img = img_cache[terrain.img]
+            if img not in img_cache:
+                img_cache[img] = Image.open(os.path.join(STATIC_TILE_PATH, "%s.png" % img))
+            tile_img = img_cache[img]
             chunk_img.paste(
                 tile_img,
                 (
@@ -96,21 +104,37 @@ def render(chunk_id):
                 tile_img
             )
 
-        chunk_img.save(os.path.join(STATIC_CHUNK_PATH, "%d.%d.png" % (chunk.cx, chunk.cy)))
-        chunk.fresh = True
+        chunk_img.save(os.path.join(STATIC_CHUNK_PATH, "%d.%d.png" % (cx, cy)))
 
-        sess.add(chunk)
+        sess.query(Chunk).filter(Chunk.id == chunk_id).update({ "fresh" : True }, synchronize_session=False)
         sess.commit()
 
-        logging.info("Rendered chunk at (%d, %d)" % (chunk.cx, chunk.cy))
+        logging.info("Rendered chunk at (%d, %d)" % (cx, cy))
     except Exception, e:
         logging.error("Got exception: %s: %s" % (e.__class__.__name__, e))
 
+def initializeRenderer():
+    """
+    Initialize a renderer process. Interrupts are left to the supervising
+    process, which shuts the pool down itself.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    skeletonSetup()
+
 class RendererSupervisor(object):
+    def __init__(self, grids=None):
+        """
+        :Parameters:
+             * ``grids``
+               Realm grid registry to take the layout of chunks from. Without
+               one, it is read from the database.
+        """
+        self.grids = grids
+
     def go(self):
         self.pool = Pool(
             processes=options.render_process_num,
-            initializer=skeletonSetup
+            initializer=initializeRenderer
         )
         logging.info("Started renderer with %d processes" % options.render_process_num)
 
@@ -124,17 +148,49 @@ class RendererSupervisor(object):
     def renderRealm(self, realm_id, callback=None):
         callback = callback or (lambda *args, **kwargs: None)
 
-        chunk_cur = meta.Session().query(Chunk).filter(Chunk.realm_id == realm_id)
-        chunk_num = [ 0, chunk_cur.count() ]
+        if self.grids is not None:
+            chunk_ids = self.grids.grid(realm_id).chunks()
+        else:
+            chunk_ids = [ chunk_id for chunk_id, in meta.Session().query(Chunk.id).filter(Chunk.realm_id == realm_id) ]
+
+        chunk_num = [ 0, len(chunk_ids) ]
 
         def _callback(*args, **kwargs):
             chunk_num[0] += 1
             if chunk_num[0] == chunk_num[1]:
                 callback(*args, **kwargs)
 
-        for chunk in chunk_cur:
-            self.renderChunk(chunk.id, callback=_callback)
+        for chunk_id in chunk_ids:
+            self.renderChunk(chunk_id, callback=_callback)
+
+    def chunkLayout(self, chunk_id):
+        """
+        Get the coordinates of a chunk and its tiles, as passed to ``render``.
+
+        :Parameters:
+             * ``chunk_id``
+               The ID of the chunk.
+        """
+        located = self.grids is not None and self.grids.locateChunk(chunk_id) or None
+
+        if located is not None:
+            grid, (cx, cy) = located
+            return cx, cy, [ (rx, ry, terrain.img) for rx, ry, terrain in grid.chunkTiles(chunk_id) ]
+
+        # not in a loaded grid
+
+        sess = meta.Session()
+
+        cx, cy = sess.query(Chunk.cx, Chunk.cy).filter(Chunk.id == chunk_id).one()
+        tiles = sess.query(Tile.rx, Tile.ry, Terrain.img) \
+            .filter(Tile.terrain_id == Terrain.id) \
+            .filter(Tile.chunk_id == chunk_id) \
+            .all()
+
+        return cx, cy, [ tuple(tile) for tile in tiles ]
 
     def renderChunk(self, chunk_id, callback=None):
         callback = callback or (lambda *args, **kwargs: None)
-        self.pool.apply_async(render, (chunk_id,), callback=callback)
+
+        cx, cy, tiles = self.chunkLayout(chunk_id)
+        self.pool.apply_async(render, (chunk_id, cx, cy, tiles), callback=callback)
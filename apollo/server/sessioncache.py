@@ -0,0 +1,158 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Node-local cache of session tokens.
+"""
+
+import uuid
+
+from tornado.options import options
+
+from apollo.server.component import Component
+
+from apollo.server.models import meta
+from apollo.server.models.auth import Session
+
+from apollo.server.protocol.packet import DELIVERY_TRANSIENT
+
+from apollo.server.util.cache import TTLCache
+
+class SessionCache(Component):
+    """
+    Maps session tokens to their session's ID and user ID so the HTTP
+    handlers don't have to query the ``sessions`` table on every request.
+
+    Only sessions with a logged in user are cached, so logging in on another
+    node can never leave a stale anonymous entry behind.
+
+    Invalidating a session is announced over ``sessions.*``, so a session
+    logged out, kicked or expired on one node stops being served from the
+    cache of every other node. A token revoked recently (i.e. logged out or
+    expired) isn't cached again until ``session_cache_ttl`` has passed, in
+    case a lookup raced with the change.
+    """
+    def __init__(self, core):
+        super(SessionCache, self).__init__(core)
+        self.cache = TTLCache(options.session_cache_ttl, max_size=options.session_cache_size, name="sessions")
+        self.revoked = TTLCache(options.session_cache_ttl, max_size=options.session_cache_size)
+
+    def go(self):
+        """
+        Start listening for sessions invalidated by other nodes.
+        """
+        self.core.bus.onReady(self.on_bus_ready)
+
+        # invalidations may have been missed while the bus was down
+        self.core.bus.onReconnect(self.cache.clear)
+
+    def on_bus_ready(self):
+        queue = "sessions:%s" % self.core.bus.busName
+        self.core.bus.declareQueue(queue, lambda *args: self.on_queue_declared(queue), exclusive=True)
+
+    def on_queue_declared(self, queue):
+        bus = self.core.bus
+
+        bus.consume(queue, self.on_invalidate, no_ack=True)
+        bus.bindQueue(queue, "sessions.#")
+
+    def on_invalidate(self, channel, method, header, body):
+        """
+        Forget a session invalidated by another node.
+        """
+        prefixparts = method.routing_key.split(".")
+
+        if prefixparts[3] == self.core.bus.busName:
+            return
+
+        self.forget(uuid.UUID(hex=prefixparts[2]), prefixparts[1] == "revoked")
+
+    def get(self, token):
+        """
+        Get the session for a token, attached to the current database session.
+        Returns ``None`` if the session does not exist.
+
+        :Parameters:
+             * ``token``
+               Session token, as a UUID.
+        """
+        sess = meta.Session()
+
+        cached = self.cache.get(token)
+        if cached is not None:
+            return sess.merge(cached, load=False)
+
+        session = sess.query(Session).get(token)
+        if session is None or session.user_id is None or self.revoked.get(token) is not None:
+            return session
+
+        # keep a detached copy around and hand out attached copies of it
+        sess.expunge(session)
+        self.cache.set(token, session)
+        return sess.merge(session, load=False)
+
+    def invalidate(self, token, revoke=True):
+        """
+        Forget a cached session, here and on every other node.
+
+        :Parameters:
+             * ``token``
+               Session token, as a UUID.
+
+             * ``revoke``
+               Whether the session is going away. If not (e.g. its user just
+               logged in), the next lookup caches it again.
+        """
+        self.forget(token, revoke)
+        self.core.bus.publish("sessions.%s.%s.%s" % (
+            revoke and "revoked" or "changed",
+            token.hex,
+            self.core.bus.busName
+        ), "", DELIVERY_TRANSIENT)
+
+    def forget(self, token, revoke=True):
+        """
+        Forget a cached session on this node only.
+
+        :Parameters:
+             * ``token``
+               Session token, as a UUID.
+
+             * ``revoke``
+               Whether the session is going away.
+        """
+        self.cache.invalidate(token)
+        if revoke:
+            self.revoked.set(token, True)
+
+    def purge(self):
+        """
+        Forget all expired sessions.
+        """
+        self.cache.purge()
+        self.revoked.purge()
+
+    def stats(self):
+        """
+        Get the hit and miss counters of the cache.
+        """
+        return self.cache.stats()
@@ -26,7 +26,6 @@ Apollo server authorization and authentication decorators.
 
 from functools import wraps
 
-from apollo.server.models.auth import SecurityDomain
 from apollo.server.protocol.packet.packeterror import PacketError, SEVERITY_WARN
 
 def requireAuthorization(domain_path):
@@ -41,7 +40,7 @@ def requireAuthorization(domain_path):
         @wraps(fn)
         def _closure(self, core, session):
             user = session.user
-            if user.inDomain(SecurityDomain.byPath(domain_path)):
+            if core.permissions.check(user.group_id, domain_path):
                 fn(self, core, session)
             else:
                 user.sendEx(core.bus, PacketError(severity=SEVERITY_WARN, msg="Not permitted to perform action."))
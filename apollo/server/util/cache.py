@@ -22,19 +22,220 @@
 
 """
 Various caching helpers.
+
+Every cache is a ``Cache``: bounded in size (evicting the least recently used
+entry), optionally expiring entries after a TTL, and able to invalidate groups
+of entries by tag. Named caches are registered so their statistics can be
+reported together.
+"""
+
+import time
+import weakref
+import functools
+
+from collections import OrderedDict
+
+registry = weakref.WeakValueDictionary()
+"""
+Named caches, by name.
 """
 
-def memoize(fn):
+class Cache(object):
+    """
+    A least recently used cache, whose entries optionally expire a fixed
+    number of seconds after they were set. Keeps hit, miss, eviction and
+    expiry counters.
+
+    Entries may be set with tags, which are invalidation keys: invalidating a
+    tag removes every entry set with it.
+    """
+    def __init__(self, max_size=None, ttl=None, name=None):
+        """
+        :Parameters:
+             * ``max_size``
+               Maximum number of entries (unbounded if ``None``).
+
+             * ``ttl``
+               Seconds after which an entry expires (never if ``None``).
+
+             * ``name``
+               Name to register the cache under, if any.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+
+        self.entries = OrderedDict()
+        self.tags = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if name is not None:
+            registry[name] = self
+
+    def get(self, key, default=None):
+        """
+        Get an entry from the cache, or ``default`` if it is missing or
+        expired.
+
+        :Parameters:
+             * ``key``
+               Key of the entry.
+
+             * ``default``
+               Value to return if there is no entry.
+        """
+        entry = self.entries.pop(key, None)
+
+        if entry is not None:
+            expiry, value, tags = entry
+            if expiry is None or expiry > time.time():
+                # move it to the most recently used end
+                self.entries[key] = entry
+                self.hits += 1
+                return value
+
+            self.expirations += 1
+            self._untag(key, tags)
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, tags=()):
+        """
+        Set an entry in the cache, evicting the least recently used entry if
+        the cache is full.
+
+        :Parameters:
+             * ``key``
+               Key of the entry.
+
+             * ``value``
+               Value of the entry.
+
+             * ``tags``
+               Invalidation keys for the entry.
+        """
+        self.invalidate(key)
+
+        expiry = self.ttl is not None and time.time() + self.ttl or None
+        self.entries[key] = (expiry, value, tuple(tags))
+
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+        while self.max_size is not None and len(self.entries) > self.max_size:
+            evicted, (expiry, value, tags) = self.entries.popitem(last=False)
+            self._untag(evicted, tags)
+            self.evictions += 1
+
+    def _untag(self, key, tags):
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, key):
+        """
+        Remove an entry from the cache, if it exists.
+
+        :Parameters:
+             * ``key``
+               Key of the entry.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._untag(key, entry[2])
+
+    def invalidateTag(self, tag):
+        """
+        Remove every entry set with a tag.
+
+        :Parameters:
+             * ``tag``
+               Invalidation key.
+        """
+        for key in list(self.tags.pop(tag, ())):
+            self.invalidate(key)
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        self.entries.clear()
+        self.tags.clear()
+
+    def purge(self):
+        """
+        Remove all expired entries from the cache.
+        """
+        if self.ttl is None:
+            return
+
+        now = time.time()
+        for key, (expiry, value, tags) in self.entries.items():
+            if expiry <= now:
+                self.invalidate(key)
+                self.expirations += 1
+
+    def stats(self):
+        """
+        Get the counters and current size of the cache.
+        """
+        return {
+            "hits"          : self.hits,
+            "misses"        : self.misses,
+            "evictions"     : self.evictions,
+            "expirations"   : self.expirations,
+            "size"          : len(self.entries)
+        }
+
+class TTLCache(Cache):
+    """
+    A cache whose entries expire a fixed number of seconds after they were
+    set.
     """
-    Memoizing decorator for functions.
+    def __init__(self, ttl, max_size=None, name=None):
+        super(TTLCache, self).__init__(max_size=max_size, ttl=ttl, name=name)
+
+_MISSING = object()
+
+def _key(args, kwargs):
+    return (args, tuple(sorted(kwargs.iteritems())))
+
+def cachedmethod(max_size=None, ttl=None):
     """
-    cache = {}
+    Caching decorator for methods. Each instance gets its own cache, which
+    goes away with it, so caching never keeps an instance alive.
+
+    :Parameters:
+         * ``max_size``
+           Maximum number of results to keep per instance.
+
+         * ``ttl``
+           Seconds to keep each result for.
+    """
+    def _decorator(fn):
+        attr = "_%s_cache" % fn.__name__
+
+        @functools.wraps(fn)
+        def _closure(self, *args, **kwargs):
+            cache = self.__dict__.get(attr)
+            if cache is None:
+                cache = self.__dict__[attr] = Cache(max_size, ttl)
+
+            key = _key(args, kwargs)
 
-    def _closure(*args, **kwargs):
-        key = (args, tuple(kwargs.iteritems()))
-        if key not in cache:
-            cache[key] = fn(*args, **kwargs)
-        return cache[key]
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = fn(self, *args, **kwargs)
+                cache.set(key, value)
+            return value
 
-    _closure.clear_cache = cache.clear
-    return _closure
+        return _closure
+    return _decorator
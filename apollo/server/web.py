@@ -32,18 +32,69 @@ import logging
 
 from tornado.options import options
 from tornado.web import RequestHandler, asynchronous, HTTPError
+from tornado.websocket import WebSocketHandler
 import uuid
 
-from apollo.server.messaging.consumer import Consumer
+from apollo.server.frontend import renderFrontend
+from apollo.server.messaging.consumer import Consumer, StreamConsumer
 
 from apollo.server.models import meta
 from apollo.server.models.auth import Session
 
 from apollo.server.protocol.packet import ORIGIN_EX
-from apollo.server.protocol.packet.meta import deserializePacket
+from apollo.server.protocol.packet.meta import deserializePackets
 from apollo.server.protocol.packet.packeterror import PacketError
 from apollo.server.protocol.packet.packetlogout import PacketLogout
 
+def dispatchPayload(core, session, payload):
+    """
+    Deserialize a payload of one or more packets sent by a client and
+    dispatch them in order.
+
+    :Parameters:
+         * ``core``
+           The Core object.
+
+         * ``session``
+           The session the payload was sent on.
+
+         * ``payload``
+           Serialized packet or array of packets.
+    """
+    try:
+        packets = deserializePackets(payload)
+    except ValueError:
+        session.sendEx(core.bus, PacketError(msg="bad packet payload"))
+        return
+
+    # one commit for the lot
+    with meta.unitOfWork():
+        for packet in packets:
+            packet._origin = ORIGIN_EX
+            packet.dispatch(core, session)
+
+def dropSession(core, token):
+    """
+    Log out the user attached to a session whose connection went away.
+
+    :Parameters:
+         * ``core``
+           The Core object.
+
+         * ``token``
+           Token of the session.
+    """
+    session = core.session_cache.get(token)
+
+    if session is None:
+        return
+
+    user = session.user
+    if not user:
+        return
+
+    user.sendInter(core.bus, PacketLogout(msg="Connection closed"))
+
 class FrontendHandler(RequestHandler):
     """
     Send the user the Apollo client frontend.
@@ -51,7 +102,43 @@ class FrontendHandler(RequestHandler):
 
     def get(self, *args, **kwargs):
         self.set_header("Content-Type", "text/html; charset=utf8")
-        self.write(self.application.loader.load("frontend.html").generate())
+
+        if options.debug:
+            # serve the individual modules so they can be debugged
+            self.write(renderFrontend(self.application.loader, "static/lib/bootstrap.js"))
+        else:
+            self.set_header("Cache-Control", "no-cache")
+            self.write(self.application.frontend.frontend)
+
+class BundleHandler(RequestHandler):
+    """
+    Send the user the Apollo client bundle. The bundle is addressed by its
+    content hash, so it can be cached forever.
+    """
+
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self, bundle_hash, *args, **kwargs):
+        frontend = self.application.frontend
+
+        if bundle_hash != frontend.bundle_hash:
+            raise HTTPError(404)
+
+        self.set_header("Content-Type", "text/javascript")
+        self.set_header("Etag", '"%s"' % frontend.bundle_hash)
+        self.set_header("Cache-Control", "public, max-age=31536000")
+        self.set_header("Vary", "Accept-Encoding")
+
+        if self.request.headers.get("If-None-Match"):
+            # nothing but this exact bundle can have this URL
+            self.set_status(304)
+            return
+
+        if "gzip" in self.request.headers.get("Accept-Encoding", ""):
+            self.set_header("Content-Encoding", "gzip")
+            self.write(frontend.bundle_gzipped)
+        else:
+            self.write(frontend.bundle)
 
 class SessionHandler(RequestHandler):
     """
@@ -61,6 +148,10 @@ class SessionHandler(RequestHandler):
     SUPPORTED_METHODS = ("GET",)
 
     def get(self, *args, **kwargs):
+        if self.application.bus.congested():
+            # shed new clients before existing ones start losing packets
+            raise HTTPError(503)
+
         self.set_header("Content-Type", "application/json")
 
         session = Session()
@@ -68,10 +159,17 @@ class SessionHandler(RequestHandler):
         sess.add(session)
         sess.commit()
 
-        # declare queue
+        # declare queue (durable, so persistent packets survive a broker
+        # restart, but bounded and removed by the broker once nobody has used
+        # it for a while)
         self.application.bus.declareQueue(
             "ex:%s" % session.id,
-            lambda *args: session.queueBind(self.application.bus, session)
+            lambda *args: session.queueBind(self.application.bus, session),
+            durable=True,
+            arguments={
+                "x-expires"     : options.session_queue_expiry * 1000,
+                "x-max-length"  : options.session_queue_length
+            }
         )
 
         logging.info("Acquired session: %s" % session.id)
@@ -82,24 +180,18 @@ class SessionHandler(RequestHandler):
 
 class ActionHandler(RequestHandler):
     """
-    Endpoint for sending packets to the Apollo server.
+    Endpoint for sending packets to the Apollo server. The payload may be a
+    single packet or an array of packets, which are dispatched in order
+    against the same session and committed together.
     """
 
     SUPPORTED_METHODS = ("POST",)
 
     def post(self, *args, **kwargs):
         self.token = uuid.UUID(hex=self.get_argument("s"))
-        session = meta.Session().query(Session).get(self.token)
+        session = self.application.session_cache.get(self.token)
 
-        payload = self.get_argument("p")
-
-        try:
-            packet = deserializePacket(payload)
-            packet._origin = ORIGIN_EX
-        except ValueError:
-            session.sendEx(self.application.bus, PacketError(msg="bad packet payload"))
-        else:
-            packet.dispatch(self.application, session)
+        dispatchPayload(self.application, session, self.get_argument("p"))
 
         self.finish()
 
@@ -110,18 +202,17 @@ class EventsHandler(RequestHandler):
 
     SUPPORTED_METHODS = ("GET",)
 
-    def on_connection_close(self):
-        session = meta.Session().query(Session).get(self.token)
+    consumer = None
+    clean = True
 
-        if session is None:
+    def on_connection_close(self):
+        if self.consumer is None:
             return
 
-        user = session.user
-        if not user:
-            return
+        self.consumer.shutdown()
 
         if not self.clean:
-            user.sendInter(self.application.bus, PacketLogout(msg="Connection closed"))
+            dropSession(self.application, uuid.UUID(hex=self.token))
 
     def finish(self, chunk=None):
         super(EventsHandler, self).finish(chunk)
@@ -134,10 +225,64 @@ class EventsHandler(RequestHandler):
         self.set_header("Content-Type", "application/json")
 
         self.token = self.get_argument("s")
+
+        try:
+            uuid.UUID(hex=self.token)
+        except ValueError:
+            raise HTTPError(400)
+
         self.consumer = Consumer(self)
 
         self.consumer.eat()
 
+class SocketHandler(WebSocketHandler):
+    """
+    Endpoint for exchanging packets with the Apollo server over a single
+    persistent WebSocket connection.
+    """
+
+    def open(self, *args, **kwargs):
+        self.consumer = None
+
+        try:
+            self.session_id = uuid.UUID(hex=self.get_argument("s"))
+        except (HTTPError, ValueError):
+            # too late for an HTTP error, the connection's already upgraded
+            self.write_message("[%s]" % PacketError(msg="bad session token").freeze())
+            self.close()
+            return
+
+        self.token = self.session_id.hex
+        self.consumer = StreamConsumer(self)
+
+        self.consumer.eat()
+
+        if self.consumer.session is None:
+            self.close()
+
+    def on_message(self, message):
+        if self.consumer is None:
+            return
+
+        session = self.application.session_cache.get(self.session_id)
+
+        if session is None:
+            self.close()
+            return
+
+        dispatchPayload(self.application, session, message)
+
+    def on_close(self):
+        if self.consumer is None:
+            return
+
+        self.consumer.shutdown()
+
+        # a connection that never got a session has nothing to drop, and one
+        # whose session was logged out is gone from the session cache
+        if self.consumer.session is not None:
+            dropSession(self.application, self.session_id)
+
 class DylibHandler(RequestHandler):
     """
     Apollo dylib endpoint.
@@ -146,8 +291,28 @@ class DylibHandler(RequestHandler):
     SUPPORTED_METHODS = ("GET",)
 
     def get(self, pathspec, *args, **kwargs):
-        self.set_header("Content-Type", "text/javascript")
-        dylib_data = self.application.dylib_dispatcher.dispatch(pathspec)
-        if dylib_data is None:
+        dylib = self.application.dylib_dispatcher.dispatch(pathspec)
+        if dylib is None:
             raise HTTPError(404)
-        self.write(dylib_data)
+
+        gzipped = "gzip" in self.request.headers.get("Accept-Encoding", "")
+
+        # each encoding is a different representation, so it needs its own
+        # validator
+        etag = gzipped and '"%s-gz"' % dylib.etag or '"%s"' % dylib.etag
+
+        self.set_header("Content-Type", "text/javascript")
+        self.set_header("Etag", etag)
+        self.set_header("Cache-Control", "public, max-age=%d" % options.dylib_max_age)
+        self.set_header("Vary", "Accept-Encoding")
+
+        inm = self.request.headers.get("If-None-Match")
+        if inm and (inm == "*" or etag in [ tag.strip() for tag in inm.split(",") ]):
+            self.set_status(304)
+            return
+
+        if gzipped:
+            self.set_header("Content-Encoding", "gzip")
+            self.write(dylib.gzipped)
+        else:
+            self.write(dylib.data)
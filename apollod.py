@@ -21,22 +21,48 @@
 # THE SOFTWARE.
 #
 
+import signal
+import logging
+
 from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
 from tornado.options import parse_command_line, parse_config_file, options
 
 from tornado.ioloop import IOLoop
 
 from apollo.server import setupOptions
 from apollo.server.core import Core
+from apollo.server.process import forkWorkers
+
+def serve(sockets, render_owner=True):
+    """
+    Run a server on already bound sockets until it is told to stop.
+    """
+    core = Core(render_owner=render_owner)
+    server = HTTPServer(core)
+    server.add_sockets(sockets)
+    core.go()
+
+    def shutdown(signum, frame):
+        IOLoop.instance().add_callback(lambda: core.stop(server))
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    IOLoop.instance().start()
 
 if __name__ == "__main__":
     setupOptions()
     parse_config_file("apollod.conf")
     parse_command_line()
 
-    core = Core()
-    server = HTTPServer(core)
-    server.bind(options.port, options.address)
-    server.start()
-    core.go()
-    IOLoop.instance().start()
+    # bind before forking, so every worker accepts on the same socket
+    sockets = bind_sockets(options.port, options.address)
+
+    if options.processes > 1 and options.bus_backend == "loopback":
+        logging.warn("The loopback bus only works in one process; not forking.")
+        serve(sockets)
+    elif options.processes > 1:
+        forkWorkers(options.processes, lambda task_id: serve(sockets, render_owner=task_id == 0))
+    else:
+        serve(sockets)
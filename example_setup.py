@@ -6,6 +6,7 @@ import random
 from apollo.server import skeletonSetup
 
 from apollo.server.render.supervisor import RendererSupervisor
+from apollo.server.realmgrid import announceChange
 
 from apollo.server.models import meta
 
@@ -96,6 +97,9 @@ if __name__ == "__main__":
 
     print "Chunks rendered."
 
+    # in case any servers are running against this database
+    announceChange()
+
     print "Populating with first-run data..."
 
     # create professions
@@ -31,6 +31,63 @@ dojo.require("apollo.client.dylib.packetlist");
 dojo.require("apollo.client.dylib.config");
 
 dojo.declare("apollo.client.protocol.Transport", apollo.client.Component, {
+    constructor : function()
+    {
+        this.outbox = [];
+    },
+
+    openSocket : function()
+    {
+        var loc = window.location;
+
+        this.socket = new WebSocket(
+            (loc.protocol == "https:" ? "wss://" : "ws://") +
+            loc.host +
+            loc.pathname.replace(/[^\/]*$/, "") +
+            "ws?s=" + this.token
+        );
+
+        this.socket.onopen = dojo.hitch(this, function()
+        {
+            this.socketOpen = true;
+        });
+
+        this.socket.onmessage = dojo.hitch(this, function(e)
+        {
+            try
+            {
+                this.processEvent(dojo.fromJson(e.data));
+            } catch(e) {
+                core.die("Internal error (transport event): " + e);
+                throw e;
+            }
+        });
+
+        this.socket.onclose = dojo.hitch(this, function()
+        {
+            if(this.shutdowned) return;
+
+            if(!this.socketOpen)
+            {
+                // the socket never came up, so fall back to long-polling
+                this.socket = null;
+                this.startComets();
+                return;
+            }
+
+            core.die("Transport error (socket closed)");
+        });
+    },
+
+    startComets : function()
+    {
+        // start 4 event comet streams
+        this.eventComet();
+        this.eventComet();
+        this.eventComet();
+        this.eventComet();
+    },
+
     eventComet : function()
     {
         dojo.xhrGet({
@@ -65,6 +122,12 @@ dojo.declare("apollo.client.protocol.Transport", apollo.client.Component, {
 
     processEvent : function(packet)
     {
+        if(dojo.isArray(packet))
+        {
+            dojo.forEach(packet, this.processEvent, this);
+            return;
+        }
+
         var packetType = apollo.client.dylib.packetlist[packet._name];
 
         if(packetType)
@@ -75,10 +138,42 @@ dojo.declare("apollo.client.protocol.Transport", apollo.client.Component, {
 
     sendAction : function(packet)
     {
+        this.outbox.push(packet.dump());
+
+        if(this.outboxScheduled) return;
+        this.outboxScheduled = true;
+
+        // send everything queued up in this frame in one go (background tabs
+        // don't get animation frames, so heartbeats fall back to a timer)
+        var flush = dojo.hitch(this, this.flushActions);
+
+        if(window.requestAnimationFrame && !document.hidden)
+        {
+            window.requestAnimationFrame(flush);
+        }
+        else
+        {
+            setTimeout(flush, 16);
+        }
+    },
+
+    flushActions : function()
+    {
+        var payload = "[" + this.outbox.join(",") + "]";
+
+        this.outbox = [];
+        this.outboxScheduled = false;
+
+        if(this.socket && this.socketOpen)
+        {
+            this.socket.send(payload);
+            return;
+        }
+
         dojo.xhrPost({
             url         : "action",
             content     : {
-                p       : packet.dump(),
+                p       : payload,
                 s       : this.token
             },
             handleAs    : "text",
@@ -101,11 +196,14 @@ dojo.declare("apollo.client.protocol.Transport", apollo.client.Component, {
                 this.core.ready();
                 this.startHeartbeat();
 
-                // start 4 event comet streams
-                this.eventComet();
-                this.eventComet();
-                this.eventComet();
-                this.eventComet();
+                if(window.WebSocket)
+                {
+                    this.openSocket();
+                }
+                else
+                {
+                    this.startComets();
+                }
             }),
             error       : function(e)
             {
@@ -136,5 +234,10 @@ dojo.declare("apollo.client.protocol.Transport", apollo.client.Component, {
     {
         this.shutdowned = true;
         this.stopHeartbeat();
+
+        if(this.socket)
+        {
+            this.socket.close();
+        }
     }
 });
@@ -0,0 +1,202 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""
+Helpers shared by the tests: an in-memory database and a bus that delivers
+synchronously between several fake nodes.
+"""
+
+from sqlalchemy.engine import create_engine
+
+from apollo.server import setupOptions, OptionsError
+from apollo.server.models import meta
+
+# pull in every model so all the tables get created
+import apollo.server.models.auth
+import apollo.server.models.geography
+import apollo.server.models.rpg
+
+from apollo.server.messaging.bus import Bus
+from apollo.server.messaging.loopback import topicMatches
+
+def setupDatabase():
+    """
+    Bind the database session to a fresh in-memory database with every table
+    created. Returns the engine.
+    """
+    try:
+        setupOptions()
+    except OptionsError:
+        # already defined by an earlier test
+        pass
+
+    meta.Session.remove()
+
+    engine = create_engine("sqlite://")
+    meta.bindSession(engine)
+    meta.Base.metadata.create_all(engine)
+
+    return engine
+
+class FakeMethod(object):
+    def __init__(self, routing_key):
+        self.routing_key = routing_key
+
+class FakeExchange(object):
+    """
+    Routes messages between the ``FakeBus`` of every node, and keeps every
+    packet sent.
+    """
+    def __init__(self):
+        self.queues = {}
+        self.sent = []
+
+    def publish(self, dest, body):
+        for bindings, consumers in self.queues.itervalues():
+            if any(topicMatches(binding.split("."), dest.split(".")) for binding in bindings):
+                for callback in consumers:
+                    callback(None, FakeMethod(dest), None, body)
+
+class FakeBus(object):
+    """
+    Stands in for a node's bus. It is always ready, and does everything
+    synchronously. Inter messages are dispatched the same way as the real
+    bus does.
+    """
+    dispatchInter = Bus.__dict__["dispatchInter"]
+    broadcastEx = Bus.__dict__["broadcastEx"]
+
+    def __init__(self, core, exchange, busName):
+        self.core = core
+        self.exchange = exchange
+        self.busName = busName
+
+    def onReady(self, callback):
+        callback()
+
+    def onReconnect(self, callback):
+        pass
+
+    def declareQueue(self, queue, callback=None, **kwargs):
+        self.exchange.queues.setdefault(queue, (set(), []))
+        if callback is not None:
+            callback(None)
+
+    def bindQueue(self, queue, dest, callback=None):
+        self.exchange.queues[queue][0].add(dest)
+        if callback is not None:
+            callback(None)
+
+    def consume(self, queue, callback, no_ack=False, **kwargs):
+        self.exchange.queues[queue][1].append(callback)
+
+    def publish(self, dest, body, delivery=None):
+        self.exchange.publish(dest, body)
+
+    def send(self, dest, packet):
+        self.exchange.sent.append((dest, packet))
+
+class FakeCore(object):
+    """
+    Stands in for a node's core, with only a bus. Tests attach the
+    components they need.
+    """
+    def __init__(self, exchange, busName):
+        self.bus = FakeBus(self, exchange, busName)
+
+def createRealm():
+    """
+    Create a one chunk realm with two tiles, at (0, 0) and (1, 0). Returns the
+    realm, chunk, terrain and tiles.
+    """
+    from apollo.server.models.geography import Terrain, Realm, Chunk, Tile
+
+    sess = meta.Session()
+
+    terrain = Terrain(name=u"Grass", img=u"grass")
+    realm = Realm(name=u"Test Realm", cw=1, ch=1)
+    sess.add_all([ terrain, realm ])
+    sess.commit()
+
+    chunk = Chunk(cx=0, cy=0, realm_id=realm.id)
+    sess.add(chunk)
+    sess.commit()
+
+    tiles = [ Tile(rx=rx, ry=0, chunk_id=chunk.id, terrain_id=terrain.id) for rx in (0, 1) ]
+    sess.add_all(tiles)
+    sess.commit()
+
+    return realm, chunk, terrain, tiles
+
+def createUsers(tile, names, online=True):
+    """
+    Create users (with their group and profession) standing on a tile. Returns
+    their IDs.
+    """
+    from apollo.server.models.auth import User, Group
+    from apollo.server.models.rpg import Profession
+
+    sess = meta.Session()
+
+    group = Group(name=u"Players")
+    profession = Profession(name=u"Tester", assoc_class=u"system.professions.Tester", spawnpoint_id=tile.id)
+    sess.add_all([ group, profession ])
+    sess.commit()
+
+    users = []
+    for name in names:
+        user = User(name=name, pwhash=u"", online=online, group_id=group.id, profession_id=profession.id, location_id=tile.id)
+        sess.add(user)
+        users.append(user)
+    sess.commit()
+
+    return [ user.id for user in users ]
+
+class FakeSession(object):
+    """
+    Stands in for a client's session.
+    """
+    def __init__(self, user):
+        self.user = user
+
+class QueryCounter(object):
+    """
+    Counts the statements run on an engine while it is entered.
+    """
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.active = False
+
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        if self.active:
+            self.count += 1
+
+    def __enter__(self):
+        self.active = True
+        return self
+
+    def __exit__(self, *args):
+        self.active = False
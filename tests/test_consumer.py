@@ -0,0 +1,150 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import time
+import unittest
+
+from tornado.options import options
+
+from apollo.server.messaging.channels import CHANNEL_SESSION
+from apollo.server.messaging.consumer import SessionConsumer, Consumer
+
+from tests.helpers import setupDatabase, FakeExchange, FakeCore, FakeMethod
+
+class FakeChannel(object):
+    def __init__(self):
+        self.acked = []
+        self.rejected = []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_reject(self, delivery_tag=None, requeue=True):
+        self.rejected.append((delivery_tag, requeue))
+
+class FakePool(object):
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get(self, name):
+        return name == CHANNEL_SESSION and self.channel or None
+
+class FakeDelivery(FakeMethod):
+    def __init__(self, routing_key, delivery_tag):
+        super(FakeDelivery, self).__init__(routing_key)
+        self.delivery_tag = delivery_tag
+
+class FakeHeader(object):
+    type = "chat"
+
+class FakeRegistry(object):
+    def __init__(self, core):
+        self.core = core
+        self.released = []
+
+    def release(self, session_id):
+        self.released.append(session_id)
+
+class FakeHandler(object):
+    def __init__(self, closed=False):
+        self.closed = closed
+        self.body = None
+
+    def finish(self, body):
+        if self.closed:
+            raise IOError("Stream is closed")
+        self.body = body
+
+class SessionConsumerTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+
+        self.channel = FakeChannel()
+
+        core = FakeCore(FakeExchange(), "a")
+        core.bus.pool = FakePool(self.channel)
+        core.bus.cancel = lambda ctag: None
+
+        self.consumer = SessionConsumer(FakeRegistry(core), "session")
+
+        for tag in (1, 2, 3):
+            self.consumer.on_message(self.channel, FakeDelivery("ex.Session.session", tag), FakeHeader(), "{}")
+
+    def flush(self, handler):
+        waiter = Consumer.__new__(Consumer)
+        waiter.handler = handler
+        waiter.source = self.consumer
+        waiter.flush_timeout = None
+
+        waiter.source.attach(waiter)
+        waiter.flush()
+
+    def test_ack_on_write(self):
+        self.assertEqual(self.channel.acked, [])
+
+        self.assertEqual(len(self.consumer.drain(2)), 2)
+        self.assertEqual(self.channel.acked, [])
+
+        self.flush(FakeHandler())
+        self.assertEqual(self.channel.acked, [ 3 ])
+
+    def test_requeue_on_closed_request(self):
+        self.flush(FakeHandler(closed=True))
+
+        self.assertEqual(self.channel.acked, [])
+        self.assertEqual(self.channel.rejected, [ (1, True), (2, True), (3, True) ])
+
+    def test_release_leftovers(self):
+        old_batch_size = options.events_batch_size
+        options.events_batch_size = 2
+
+        try:
+            self.flush(FakeHandler())
+        finally:
+            options.events_batch_size = old_batch_size
+
+        # the last message may be wanted on another node
+        self.assertEqual(self.channel.acked, [ 1, 2 ])
+        self.assertEqual(self.consumer.registry.released, [ "session" ])
+
+    def test_stranded(self):
+        self.assertFalse(self.consumer.stranded())
+
+        self.consumer.last_attached = time.time() - options.session_consumer_stranded - 1
+        self.assertTrue(self.consumer.stranded())
+
+    def test_requeue_on_shutdown(self):
+        self.consumer.ack(self.consumer.drain(1))
+        self.consumer.shutdown()
+
+        self.assertEqual(self.channel.acked, [ 1 ])
+        self.assertEqual(self.channel.rejected, [ (2, True), (3, True) ])
+
+    def test_skip_closed_channel(self):
+        # the broker has already requeued these
+        self.consumer.bus.pool.channel = FakeChannel()
+
+        self.assertEqual(self.consumer.drain(), [])
+        self.assertEqual(self.channel.acked, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.auth import User
+from apollo.server.messaging.index import RoutingIndex
+from apollo.server.messaging.partition import partitionKey
+from apollo.server.realmgrid import RealmGridRegistry
+
+from apollo.server.protocol.packet.packetinfo import PacketInfo
+from apollo.server.protocol.packet.packetlogin import PacketLogin
+from apollo.server.protocol.packet.packetuser import PacketUser
+
+from tests.helpers import setupDatabase, createRealm, createUsers, FakeExchange, FakeCore, FakeSession
+
+class HeldExchange(FakeExchange):
+    """
+    A ``FakeExchange`` that holds on to routing index announcements until
+    they're released, as if they were stuck behind other traffic.
+    """
+    def __init__(self):
+        super(HeldExchange, self).__init__()
+        self.held = []
+
+    def publish(self, dest, body):
+        if dest.startswith("index."):
+            self.held.append((dest, body))
+        else:
+            super(HeldExchange, self).publish(dest, body)
+
+    def release(self):
+        held, self.held = self.held, []
+        for dest, body in held:
+            super(HeldExchange, self).publish(dest, body)
+
+class LoginTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+
+        self.exchange = HeldExchange()
+        self.nodes = [ FakeCore(self.exchange, name) for name in ("a", "b") ]
+
+        for node in self.nodes:
+            node.grids = RealmGridRegistry(node)
+            node.routing = RoutingIndex(node)
+            node.routing.go()
+
+        self.realm, self.chunk, self.terrain, self.tiles = createRealm()
+        self.user_id, = createUsers(self.tiles[0], [ u"alice" ], online=False)
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def test_first_packets_beat_index(self):
+        a, b = self.nodes
+
+        session = FakeSession(meta.Session().query(User).get(self.user_id))
+        PacketLogin()._dispatch_stage_2(a, session)
+
+        # node b owns the tile's partition, and gets the inter packets before
+        # it hears the user is online
+        for dest, packet in self.exchange.sent[:]:
+            if dest.startswith("inter."):
+                b.bus.dispatchInter(partitionKey(dest), packet.freeze())
+
+        self.exchange.release()
+        self.assertTrue(b.routing.isOnline(self.user_id))
+
+        user_key = "ex.User.%s" % self.user_id
+        sent = [ packet.__class__ for dest, packet in self.exchange.sent if dest == user_key ]
+
+        self.assertTrue(PacketInfo in sent)
+        self.assertTrue(PacketUser in sent)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.geography import Terrain, Tile
+from apollo.server.realmgrid import RealmGridRegistry
+
+from tests.helpers import setupDatabase, createRealm, FakeExchange, FakeCore
+
+class RealmGridTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+
+        exchange = FakeExchange()
+        self.nodes = [ FakeCore(exchange, name) for name in ("a", "b") ]
+
+        for node in self.nodes:
+            node.grids = RealmGridRegistry(node)
+            node.grids.go()
+
+        self.realm, self.chunk, self.terrain, self.tiles = createRealm()
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def test_lookup(self):
+        grid = self.nodes[0].grids.grid(self.realm.id)
+
+        self.assertEqual(grid.tileAt(1, 0), self.tiles[1].id)
+        self.assertEqual(grid.tileAt(2, 0), None)
+        self.assertEqual(grid.chunkAt(1, 0), self.chunk.id)
+        self.assertEqual(grid.terrainAt(0, 0).img, u"grass")
+        self.assertEqual(self.nodes[0].grids.locate(self.tiles[1].id), (grid, (1, 0)))
+
+    def test_change_refreshes_other_nodes(self):
+        a, b = self.nodes
+        self.assertEqual(b.grids.grid(self.realm.id).tileAt(2, 0), None)
+
+        # node a adds a tile with a terrain type added since b loaded
+        sess = meta.Session()
+
+        sand = Terrain(name=u"Sand", img=u"sand")
+        sess.add(sand)
+        sess.commit()
+
+        tile = Tile(rx=2, ry=0, chunk_id=self.chunk.id, terrain_id=sand.id)
+        sess.add(tile)
+        sess.commit()
+
+        a.grids.changed(self.realm.id)
+
+        grid = b.grids.grid(self.realm.id)
+        self.assertEqual(grid.tileAt(2, 0), tile.id)
+        self.assertEqual(grid.terrainAt(2, 0).img, u"sand")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import uuid
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.auth import Session
+from apollo.server.sessioncache import SessionCache
+
+from tests.helpers import setupDatabase, FakeExchange, FakeCore
+
+class SessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+
+        exchange = FakeExchange()
+        self.nodes = [ FakeCore(exchange, name) for name in ("a", "b") ]
+
+        for node in self.nodes:
+            node.session_cache = SessionCache(node)
+            node.session_cache.go()
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def createSession(self):
+        sess = meta.Session()
+
+        session = Session(user_id=uuid.uuid4())
+        sess.add(session)
+        sess.commit()
+
+        return session.id
+
+    def test_logout_invalidates_other_nodes(self):
+        a, b = self.nodes
+        token = self.createSession()
+
+        # node b has the session cached
+        self.assertNotEqual(b.session_cache.get(token), None)
+
+        # the logout is handled on node a
+        sess = meta.Session()
+        sess.query(Session).filter(Session.id == token).delete()
+        sess.commit()
+        a.session_cache.invalidate(token)
+
+        self.assertEqual(b.session_cache.get(token), None)
+
+    def test_invalidated_session_not_cached_again(self):
+        a, b = self.nodes
+        token = self.createSession()
+
+        # the other node looks the session up again before the logout is
+        # committed, and mustn't keep it
+        a.session_cache.invalidate(token)
+        self.assertNotEqual(b.session_cache.get(token), None)
+
+        sess = meta.Session()
+        sess.query(Session).filter(Session.id == token).delete()
+        sess.commit()
+
+        self.assertEqual(b.session_cache.get(token), None)
+
+    def test_login_cached_again(self):
+        a, b = self.nodes
+        token = self.createSession()
+
+        b.session_cache.get(token)
+
+        # the session's user changed on node a
+        a.session_cache.invalidate(token, revoke=False)
+
+        for node in self.nodes:
+            node.session_cache.get(token)
+            self.assertNotEqual(node.session_cache.cache.get(token), None)
+
+if __name__ == "__main__":
+    unittest.main()
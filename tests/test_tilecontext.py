@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import uuid
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.auth import User
+from apollo.server.messaging.index import RoutingIndex
+from apollo.server.realmgrid import RealmGridRegistry
+
+from apollo.server.protocol.packet.packeterror import PacketError
+from apollo.server.protocol.packet.packetinfo import PacketInfo
+from apollo.server.protocol.packet.packetmove import PacketMove
+from apollo.server.protocol.packet.packetuser import PacketUser
+
+from tests.helpers import setupDatabase, createRealm, createUsers, FakeExchange, FakeCore, FakeSession, QueryCounter
+
+class TileContextTest(unittest.TestCase):
+    def setUp(self):
+        # listen before any connection is made, so every one is counted
+        self.counter = QueryCounter(setupDatabase())
+
+        self.exchange = FakeExchange()
+        self.core = FakeCore(self.exchange, "a")
+        self.core.grids = RealmGridRegistry(self.core)
+
+        self.realm, self.chunk, self.terrain, self.tiles = createRealm()
+        self.user_ids = createUsers(self.tiles[1], [ u"alice", u"bob" ])
+
+        # the grid is loaded once per process, not per packet
+        self.core.grids.grid(self.realm.id)
+
+        meta.Session.expunge_all()
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def session(self, user_id):
+        return FakeSession(meta.Session().query(User).get(user_id))
+
+    def test_info_one_query(self):
+        session = self.session(self.user_ids[0])
+
+        with self.counter as counter:
+            PacketInfo().dispatch(self.core, session)
+
+        self.assertEqual(counter.count, 1)
+
+        dest, packet = self.exchange.sent[-1]
+        self.assertEqual(packet.location, { "x" : 1, "y" : 0, "realm" : u"Test Realm" })
+        self.assertEqual(packet.terrain["img"], u"grass")
+        self.assertEqual([ thing["name"] for thing in packet.things ], [ u"bob" ])
+
+    def test_user_one_query(self):
+        session = self.session(self.user_ids[0])
+
+        with self.counter as counter:
+            PacketUser().dispatch(self.core, session)
+
+        # the profession
+        self.assertEqual(counter.count, 1)
+
+        dest, packet = self.exchange.sent[-1]
+        self.assertEqual(packet.profession, u"Tester")
+        self.assertEqual(packet.location, { "x" : 1, "y" : 0, "realm" : u"Test Realm" })
+
+    def test_info_missing_tile(self):
+        session = self.session(self.user_ids[0])
+        session.user.location_id = uuid.uuid4()
+
+        PacketInfo().dispatch(self.core, session)
+
+        dest, packet = self.exchange.sent[-1]
+        self.assertTrue(isinstance(packet, PacketError))
+
+    def test_move_from_missing_tile(self):
+        self.core.routing = RoutingIndex(self.core)
+
+        session = self.session(self.user_ids[0])
+        session.user.location_id = uuid.uuid4()
+
+        PacketMove(x=0, y=0).dispatch(self.core, session)
+
+        dest, packet = self.exchange.sent[-1]
+        self.assertEqual(packet.msg, "Cannot move there.")
+
+if __name__ == "__main__":
+    unittest.main()
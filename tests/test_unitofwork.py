@@ -0,0 +1,75 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.geography import Terrain
+
+from tests.helpers import setupDatabase
+
+class UnitOfWorkTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+        self.committed = []
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def addTerrain(self, name):
+        meta.Session().add(Terrain(name=name, img=name))
+        meta.commit(lambda: self.committed.append(name))
+
+    def terrains(self):
+        return sorted(name for name, in meta.Session().query(Terrain.name))
+
+    def test_commit_once(self):
+        with meta.unitOfWork():
+            self.addTerrain(u"grass")
+            self.addTerrain(u"sand")
+
+            # nothing is announced until the end
+            self.assertEqual(self.committed, [])
+
+        self.assertEqual(self.committed, [ u"grass", u"sand" ])
+        self.assertEqual(self.terrains(), [ u"grass", u"sand" ])
+
+    def test_rollback(self):
+        def _work():
+            with meta.unitOfWork():
+                self.addTerrain(u"grass")
+                raise RuntimeError("handler failed")
+
+        self.assertRaises(RuntimeError, _work)
+
+        self.assertEqual(self.committed, [])
+        self.assertEqual(self.terrains(), [])
+
+    def test_outside(self):
+        self.addTerrain(u"grass")
+
+        self.assertEqual(self.committed, [ u"grass" ])
+        meta.Session.rollback()
+        self.assertEqual(self.terrains(), [ u"grass" ])
+
+if __name__ == "__main__":
+    unittest.main()
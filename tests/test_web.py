@@ -0,0 +1,115 @@
+#
+# Copyright (C) 2011 by Tony Young
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import uuid
+import unittest
+
+from apollo.server.models import meta
+from apollo.server.models.auth import Session
+from apollo.server.sessioncache import SessionCache
+from apollo.server.web import EventsHandler, SocketHandler
+
+from tests.helpers import setupDatabase, FakeExchange, FakeCore, createRealm, createUsers
+
+class FakeSocketHandler(SocketHandler):
+    """
+    A ``SocketHandler`` with no connection behind it.
+    """
+    def __init__(self, application, arguments):
+        self.application = application
+        self.arguments = arguments
+
+        self.messages = []
+        self.closed = False
+
+    def get_argument(self, name, *args):
+        return self.arguments[name]
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+    def close(self):
+        self.closed = True
+
+class FakeStreamConsumer(object):
+    def __init__(self, session):
+        self.session = session
+
+    def shutdown(self):
+        pass
+
+class SocketHandlerTest(unittest.TestCase):
+    def setUp(self):
+        setupDatabase()
+
+        self.exchange = FakeExchange()
+        self.core = FakeCore(self.exchange, "a")
+        self.core.session_cache = SessionCache(self.core)
+        self.core.session_cache.go()
+
+    def tearDown(self):
+        meta.Session.remove()
+
+    def test_bad_token_rejected(self):
+        handler = FakeSocketHandler(self.core, { "s": "not a token" })
+        handler.open()
+
+        self.assertTrue(handler.closed)
+        self.assertEqual(json.loads(handler.messages[0])[0]["_name"], "error")
+
+        # nothing to tear down
+        handler.on_close()
+        self.assertEqual(self.exchange.sent, [])
+
+    def test_close_after_logout(self):
+        realm, chunk, terrain, tiles = createRealm()
+        user_id, = createUsers(tiles[0], [ u"alice" ])
+
+        sess = meta.Session()
+        session = Session(user_id=user_id)
+        sess.add(session)
+        sess.commit()
+
+        token = session.id
+
+        handler = FakeSocketHandler(self.core, { "s": token.hex })
+        handler.session_id = token
+        handler.consumer = FakeStreamConsumer(self.core.session_cache.get(token))
+
+        # the user logs out cleanly before the connection closes
+        sess.query(Session).filter(Session.id == token).delete()
+        sess.commit()
+        self.core.session_cache.invalidate(token)
+
+        handler.on_close()
+        self.assertEqual(self.exchange.sent, [])
+
+class EventsHandlerTest(unittest.TestCase):
+    def test_close_before_get(self):
+        handler = EventsHandler.__new__(EventsHandler)
+
+        # nothing was set up, so there's nothing to tear down
+        handler.on_connection_close()
+
+if __name__ == "__main__":
+    unittest.main()
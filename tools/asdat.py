@@ -39,12 +39,20 @@ from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from apollo.server import skeletonSetup
 from apollo.server.models import meta
 from apollo.server.models.auth import Group, SecurityDomain, INDIRECTLY_IN_DOMAIN, DIRECTLY_IN_DOMAIN, User
+from apollo.server.permissions import announceChange
 
 class ASDAT(object):
     def __init__(self):
         skeletonSetup(os.path.join(dist_root, "apollod.conf"))
         self.sess = meta.Session()
 
+    def announce(self):
+        """
+        Tell running servers to recompile their permissions.
+        """
+        if not announceChange():
+            print "Could not reach the message bus; servers will pick up the change within permission_cache_ttl seconds."
+
     #
     # domain actions
     #
@@ -83,6 +91,12 @@ About security domain %(path)s:
             "parent_id"     : domain.parent.id
         }
 
+    def action_dompaths(self):
+        updated = SecurityDomain.rebuildPaths()
+        self.announce()
+
+        print "Rebuilt the paths of %d domain(s)." % updated
+
     def action_domadd(self, path):
         raise NotImplementedError("domadd not implemented") # TODO: implement
 
@@ -105,6 +119,7 @@ About security domain %(path)s:
 
         recursiveDomainDelete(domain, tuple(path.split(".")))
         self.sess.commit()
+        self.announce()
 
         print "The following domains were deleted:"
         for domain_name in affected_domains:
@@ -180,6 +195,7 @@ About group %(name)s:
         group.security_domains.append(domain)
         self.sess.merge(group)
         self.sess.commit()
+        self.announce()
 
         print "Group \"%s\" added to domain %s." % (group.name, path)
 
@@ -203,6 +219,7 @@ About group %(name)s:
         group.security_domains.remove(domain)
         self.sess.merge(group)
         self.sess.commit()
+        self.announce()
 
         print "Group \"%s\" removed from domain %s." % (group.name, path)
 
@@ -286,6 +303,7 @@ Commands:
         dominfo     Get information about a domain.
         domadd      Create a new security domain by path.
         domdel      Delete a security domain by path.
+        dompaths    Rebuild the stored paths of all security domains.
 
     Groups:
         grplist     List all groups.
@@ -21,15 +21,48 @@
 #
 
 """
-A script for compiling the frontend templates into one static file.
+A script for building the frontend: renders the frontend template and compiles
+the Apollo client modules and dylibs into one content-hashed bundle.
+
+Usage: frontendgen.py [OUTPUT_DIR]
 """
 
+import sys
 import os
+import hashlib
+
+dist_root = os.path.join(os.path.dirname(__file__), "..")
+
+# add the apollo path to the pythonpath
+sys.path.insert(1, dist_root)
 
+from tornado.options import parse_config_file
 from tornado.template import Loader
 
-dist_root = os.path.join(os.path.dirname(__file__), "..")
+from apollo.server import setupOptions
+from apollo.server.dylib.meta import DylibDispatcher
+from apollo.server.frontend import buildBundle, renderFrontend
+
 loader = Loader(os.path.join(dist_root, "template"))
 
 if __name__ == "__main__":
-    print loader.load("frontend.html").generate()
+    setupOptions()
+    parse_config_file(os.path.join(dist_root, "apollod.conf"))
+
+    output_dir = len(sys.argv) > 1 and sys.argv[1] or os.path.join(dist_root, "build")
+
+    dylibs = dict((name, dylib.data) for name, dylib in DylibDispatcher(None).compiled.iteritems())
+
+    bundle = buildBundle(dist_root, dylibs)
+    bundle_path = "bundle/%s.js" % hashlib.sha1(bundle).hexdigest()
+
+    if not os.path.isdir(os.path.join(output_dir, "bundle")):
+        os.makedirs(os.path.join(output_dir, "bundle"))
+
+    with open(os.path.join(output_dir, bundle_path), "w") as f:
+        f.write(bundle)
+
+    with open(os.path.join(output_dir, "frontend.html"), "w") as f:
+        f.write(renderFrontend(loader, bundle_path))
+
+    print "Wrote %s and frontend.html to %s" % (bundle_path, output_dir)